@@ -13,9 +13,13 @@ from textual.widgets import Footer, Header
 
 from .components.docker_table import DockerComposeController
 from .components.interactive_shell import InteractiveShell
-from .components.logs import Logs, CommandLogger
+from .components.logs import Logs, CommandLogger, StreamLogs
 from .components.panes import Panes
 from .hooks import Hooks
+from .log_file import LogFileStream
+from .log_store import LogStore
+from .log_streams import DEFAULT_LOG_TAIL, LogStreams, MergedLogStream, ProjectLogStream
+from .status_service import StatusService
 
 global_loggers = []
 
@@ -27,6 +31,10 @@ def global_log(message, source=None):
 
 
 class DebugScreen(Screen):
+    BINDINGS = [
+        Binding("p", "poll_stats", "Poll stats"),
+    ]
+
     def compose(self) -> ComposeResult:
         logger = Logs()
         global_loggers.append(logger)
@@ -34,6 +42,10 @@ class DebugScreen(Screen):
         yield logger
         yield Footer()
 
+    def action_poll_stats(self):
+        for controller, schedule in self.app.status_service.stats().items():
+            global_log(f"{controller.docker_file}: {schedule}")
+
 
 class DockerComposePanel(Vertical):
     # BINDINGS = (
@@ -83,6 +95,7 @@ class DockerScreen(Screen):
         Binding("ctrl+u", "up", "Up all"),
         Binding("ctrl+d", "down", "Down all"),
         Binding("ctrl+l", "logs", "Logs all"),
+        Binding("L", "merged_logs", "Logs merged"),
         Binding("ctrl+b", "build", "Build all"),
         Binding("ctrl+right_square_bracket", "next_pane", "Next Pane"),
         Binding("tab", "next_pane", "Next Pane", show=False),
@@ -102,10 +115,25 @@ class DockerScreen(Screen):
     action_running = False
     panel = None
 
-    def __init__(self, action_hooks=None, skip_service_regex=None):
+    def __init__(
+        self,
+        action_hooks=None,
+        skip_service_regex=None,
+        log_options=None,
+        shell_options=None,
+        log_tail=DEFAULT_LOG_TAIL,
+        log_files=None,
+    ):
         super().__init__()
         self.action_hooks = action_hooks
         self.skip_service_regex = skip_service_regex
+        self.log_options = log_options or {}
+        self.log_tail = log_tail
+        self.log_files = log_files or []
+        self.shell_options = shell_options or {}
+
+    def new_log_store(self):
+        return LogStore(**self.log_options)
 
     def set_docker_compose_files(self, docker_compose_files):
         self.docker_compose_files = docker_compose_files
@@ -113,6 +141,13 @@ class DockerScreen(Screen):
     def watch_show_panel(self, show_panel: bool) -> None:
         self.set_class(show_panel, "-show-panel")
 
+    def on_screen_resume(self) -> None:
+        self.app.status_service.resume()
+
+    def on_screen_suspend(self) -> None:
+        # nobody is looking at the status tables, container events still keep them current
+        self.app.status_service.pause()
+
     def compose(self) -> ComposeResult:
         self.container = Panes(id="container")
         self.overlay = Container(classes="overlay hide")
@@ -136,6 +171,13 @@ class DockerScreen(Screen):
 
         yield Footer()
 
+    def on_mount(self) -> None:
+        for path in self.log_files:
+            self.container.add_pane(
+                title=os.path.basename(path),
+                content=StreamLogs(LogFileStream(path)),
+            )
+
     # @classmethod
     # def on_key(cls, event: events.Key) -> None:
     #     print("on key DS", event)
@@ -164,17 +206,57 @@ class DockerScreen(Screen):
     def action_toggle_panel(self) -> None:
         self.show_panel = not self.show_panel
 
+    def project_log_stream(self, docker_compose):
+        # one `docker compose logs` per compose file, every log pane for it is a view on that
+        def backfill_command(until, services):
+            return docker_compose.logs(
+                services=services,
+                tail=False,
+                timestamps=True,
+                color=False,
+                lines=self.log_tail,
+                until=until,
+            )
+
+        return self.app.log_streams.get(
+            (docker_compose.docker_file,),
+            lambda: ProjectLogStream(
+                docker_compose.logs(timestamps=True, color=False, lines=self.log_tail),
+                docker_compose.project_name,
+                new_store=self.new_log_store,
+                # with the whole history there's nothing to go back for
+                backfill_command=backfill_command if self.log_tail is not None else None,
+            ),
+        )
+
     async def action_service_logs(self) -> None:
         service = self.panel.docker_compose.selected_service
+        stream = self.project_log_stream(self.panel.docker_compose.docker_compose)
         self.container.add_pane(
             title=f"{service} logs",
-            content=CommandLogger(
-                self.panel.docker_compose.docker_compose.logs(services=[service]),
-                exit_message=False,
-            ),
+            content=StreamLogs(stream.service(service)),
         )
         global_log(f"log_command done {service}")
 
+    async def action_logs(self) -> None:
+        docker_compose = self.panel.docker_compose.docker_compose
+        self.container.add_pane(
+            title=f"{docker_compose.project_name} logs",
+            content=StreamLogs(self.project_log_stream(docker_compose)),
+        )
+
+    async def action_merged_logs(self) -> None:
+        # every service's lines interleaved by their timestamps rather than by arrival
+        controller = self.panel.docker_compose
+        services = list(controller.row_keys)
+        stream = self.project_log_stream(controller.docker_compose)
+        self.container.add_pane(
+            title=f"{controller.docker_compose.project_name} logs by time",
+            content=StreamLogs(
+                MergedLogStream([stream.service(service) for service in services], services)
+            ),
+        )
+
     async def action_service_shell(self) -> None:
         service = self.panel.docker_compose.selected_service
         self.container.add_pane(
@@ -182,6 +264,7 @@ class DockerScreen(Screen):
             content=InteractiveShell(
                 self.panel.docker_compose.docker_compose.shell(service),
                 exit_message=False,
+                **self.shell_options,
             ),
         )
         # await self.container.mount(InteractiveShell(["bash"]))
@@ -194,7 +277,9 @@ class DockerScreen(Screen):
         self.container.add_pane(
             title=f"{service} run",
             content=InteractiveShell(
-                self.panel.docker_compose.docker_compose.run(service), exit_message=False
+                self.panel.docker_compose.docker_compose.run(service),
+                exit_message=False,
+                **self.shell_options,
             ),
         )
 
@@ -209,6 +294,7 @@ class DockerScreen(Screen):
 
         self.overlay.set_class(False, "hide")
         self.action_running = True
+        self.app.status_service.poke(self.panel.docker_compose)
         self.remove_temp_windows()
         await self.overlay.mount(content)
 
@@ -229,6 +315,7 @@ class DockerScreen(Screen):
                 focus=False,
                 env=os.environ
                 | {"PWD": os.path.dirname(self.panel.docker_compose.docker_file) + "/"},
+                **self.shell_options,
             )
         )
 
@@ -241,6 +328,7 @@ class DockerScreen(Screen):
                 focus=False,
                 env=os.environ
                 | {"PWD": os.path.dirname(self.panel.docker_compose.docker_file) + "/"},
+                **self.shell_options,
             )
         )
 
@@ -252,6 +340,7 @@ class DockerScreen(Screen):
                     services=[service], with_password=True
                 ),
                 exit_command=self.single_gated_service_exit(),
+                store=self.new_log_store(),
             )
         )
 
@@ -264,6 +353,7 @@ class DockerScreen(Screen):
                 focus=False,
                 env=os.environ
                 | {"PWD": os.path.dirname(self.panel.docker_compose.docker_file) + "/"},
+                **self.shell_options,
             )
         )
 
@@ -277,6 +367,7 @@ class DockerScreen(Screen):
                 focus=False,
                 env=os.environ
                 | {"PWD": os.path.dirname(self.panel.docker_compose.docker_file) + "/"},
+                **self.shell_options,
             )
         )
         self.action_hooks.execute("post_up")
@@ -287,6 +378,7 @@ class DockerScreen(Screen):
             CommandLogger(
                 self.panel.docker_compose.docker_compose.build(with_password=True),
                 exit_command=self.single_gated_service_exit(),
+                store=self.new_log_store(),
             )
         )
 
@@ -323,12 +415,30 @@ class DCUIApp(App):
         watch_css: bool = False,
         hook_file=None,
         skip_service_regex=None,
+        log_options=None,
+        shell_options=None,
+        log_tail=DEFAULT_LOG_TAIL,
+        log_files=None,
+        log_export_options=None,
+        log_tee=False,
     ):
         self.hook_file = hook_file
+        # read by the log panes when they're exported
+        self.log_export_options = log_export_options or {}
+        self.log_tee = log_tee
         self.debug_screen = DebugScreen()
-        self.docker_screen = DockerScreen(action_hooks=None, skip_service_regex=skip_service_regex)
+        self.docker_screen = DockerScreen(
+            action_hooks=None,
+            skip_service_regex=skip_service_regex,
+            log_options=log_options,
+            shell_options=shell_options,
+            log_tail=log_tail,
+            log_files=log_files,
+        )
         self.docker_screen.set_docker_compose_files(docker_compose_files or [])
         self.action_hooks = Hooks(self.hook_file or None)
+        self.status_service = StatusService()
+        self.log_streams = LogStreams()
 
         self.SCREENS = {
             "debug": self.debug_screen,
@@ -340,6 +450,7 @@ class DCUIApp(App):
     def on_mount(self):
         self.docker_screen.action_hooks = self.action_hooks
         self.action_hooks.execute("pre_startup")
+        self.run_worker(self.status_service.run(), name="status_service")
 
         self.push_screen(self.debug_screen)
         self.push_screen(self.docker_screen)
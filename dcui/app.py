@@ -5,6 +5,10 @@ import os
 import sys
 
 from . import DCUIApp
+from .log_export import COMPRESSIONS, EXPORT_SEGMENT_BYTES
+from .log_store import DEFAULT_MAX_BYTES
+from .log_streams import DEFAULT_LOG_TAIL
+from .terminal import DEFAULT_SCROLLBACK
 
 basedir = os.path.dirname(os.path.realpath(__file__))
 
@@ -27,6 +31,74 @@ def main():
         help="Regex pattern to skip service names",
     )
 
+    parser.add_argument(
+        "--log-max-lines",
+        type=int,
+        default=None,
+        help="Maximum number of lines kept in memory per log pane",
+    )
+    parser.add_argument(
+        "--log-max-bytes",
+        type=int,
+        default=DEFAULT_MAX_BYTES,
+        help="Maximum number of bytes kept in memory per log pane",
+    )
+    parser.add_argument(
+        "--log-spill",
+        action="store_true",
+        default=False,
+        help="Write lines dropped from memory to a temporary file instead of discarding them",
+    )
+    parser.add_argument(
+        "--log-tail",
+        type=int,
+        default=DEFAULT_LOG_TAIL,
+        help="Number of lines each container's logs start with, scrolling to the top fetches more,"
+        " -1 for all of them",
+    )
+    parser.add_argument(
+        "--log-file",
+        action="append",
+        default=[],
+        help="Log file to open in a pane and follow, e.g. a container's json-file log or the"
+        " .index of an export",
+    )
+    parser.add_argument(
+        "--log-export-dir",
+        default=None,
+        help="Directory log panes are exported to with e and E, the current one by default",
+    )
+    parser.add_argument(
+        "--log-export-compression",
+        choices=sorted(COMPRESSIONS),
+        default="gzip",
+        help="Compression of exported log segment files",
+    )
+    parser.add_argument(
+        "--log-export-segment-bytes",
+        type=int,
+        default=EXPORT_SEGMENT_BYTES,
+        help="Size at which an exported log segment file is finished and the next one started",
+    )
+    parser.add_argument(
+        "--log-export-keep",
+        type=int,
+        default=None,
+        help="Number of segment files a log export keeps, older ones are removed, all by default",
+    )
+    parser.add_argument(
+        "--log-tee",
+        action="store_true",
+        default=False,
+        help="Export everything each log pane shows from when it opens, as with E",
+    )
+    parser.add_argument(
+        "--shell-scrollback",
+        type=int,
+        default=DEFAULT_SCROLLBACK,
+        help="Number of lines kept after they scroll off the top of a shell pane",
+    )
+
     args = parser.parse_args()
 
     if args.config is not None:
@@ -36,14 +108,31 @@ def main():
         # Reload arguments to override config file values with command line values
         args = parser.parse_args()
 
-    if not args.docker_compose:
+    if not args.docker_compose and not args.log_file:
         parser.print_help()
         sys.exit(1)
 
     d = DCUIApp(
-        docker_compose_files=[os.path.expanduser(f) for f in args.docker_compose],
+        docker_compose_files=[os.path.expanduser(f) for f in args.docker_compose or []],
         # hook_file=os.path.expanduser(args.hook_file),
         skip_service_regex=args.skip_service_regex,
+        log_options={
+            "max_lines": args.log_max_lines,
+            "max_bytes": args.log_max_bytes,
+            "spill": args.log_spill,
+        },
+        shell_options={
+            "scrollback": args.shell_scrollback,
+        },
+        log_tail=args.log_tail if args.log_tail >= 0 else None,
+        log_files=[os.path.expanduser(f) for f in args.log_file],
+        log_export_options={
+            "directory": args.log_export_dir and os.path.expanduser(args.log_export_dir),
+            "compression": args.log_export_compression,
+            "segment_bytes": args.log_export_segment_bytes,
+            "keep": args.log_export_keep,
+        },
+        log_tee=args.log_tee,
     )
     return d
     # d.run()
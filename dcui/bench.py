@@ -0,0 +1,370 @@
+"""Benchmarks for the parts of dcui that have to keep up with a lot of output.
+
+python -m dcui.bench logs-memory --lines 5000000
+python -m dcui.bench shell-throughput --megabytes 20
+python -m dcui.bench shell-paste --kilobytes 200
+python -m dcui.bench logs-search --lines 2000000 --pattern "id=1234567$"
+python -m dcui.bench logs-file --megabytes 1000
+python -m dcui.bench logs-render --frames 200
+python -m dcui.bench logs-export --lines 2000000 --compression gzip
+"""
+
+import argparse
+import asyncio
+import gc
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from textual import events
+from textual.app import App
+
+from .components.interactive_shell import InteractiveShell
+from .components.logs import Logs
+from .log_export import ExportLogStore, LogExport, LogExportWriter
+from .log_file import INDEX_STEP_SECONDS, MappedLogStore
+from .log_search import SEARCH_STEP_SECONDS, LogSearch, compile_search
+from .log_store import LogStore
+
+
+def sample_lines(count, line_length):
+    # roughly what a service logs, same content for both representations
+    prefix = b"2024-01-01T00:00:00.000000000Z INFO worker handled request id="
+    for i in range(count):
+        line = prefix + str(i).encode()
+        yield line + b"." * max(0, line_length - len(line))
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def logs_memory(args):
+    def build_list():
+        # what Logs.data used to be, one str per line
+        return [line.decode() for line in sample_lines(args.lines, args.line_length)]
+
+    def build_store():
+        store = LogStore(max_bytes=None)
+        for line in sample_lines(args.lines, args.line_length):
+            store.append(line)
+        return store
+
+    print(f"{args.lines} lines of {args.line_length} bytes")
+    for name, build in [("list of str", build_list), ("LogStore", build_store)]:
+        result, current, elapsed = measure(build)
+        print(
+            f"{name:>12}: {current / 1024 / 1024:10.1f} MiB "
+            f"{current / args.lines:6.1f} bytes/line {elapsed:6.2f}s to fill"
+        )
+        del result
+
+
+def logs_search(args):
+    store = LogStore(max_bytes=None)
+    store.extend(sample_lines(args.lines, args.line_length))
+    search = LogSearch(store, compile_search(args.pattern))
+
+    # the steps a Logs search worker takes, each one holds the event loop
+    steps = 0
+    longest = 0.0
+    start = time.perf_counter()
+    while not search.done:
+        step = time.perf_counter()
+        search.scan(time.monotonic() + SEARCH_STEP_SECONDS)
+        longest = max(longest, time.perf_counter() - step)
+        steps += 1
+    elapsed = time.perf_counter() - start
+
+    whole = "whole segments" if search.whole_buffer else "line by line"
+    print(f"{args.lines} lines, {args.pattern!r} searched {whole}")
+    print(
+        f"{len(search)} matches in {elapsed:.2f}s, {args.lines / elapsed / 1e6:.1f}M lines/s, "
+        f"{steps} steps, longest {longest * 1000:.1f}ms"
+    )
+
+
+def resident():
+    # bytes, mapped file pages included
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def logs_file(args):
+    with tempfile.NamedTemporaryFile(prefix="dcui-bench-", suffix=".log") as f:
+        written = 0
+        lines = sample_lines(sys.maxsize, args.line_length)
+        while written < args.megabytes * 1024 * 1024:
+            chunk = b"\n".join(next(lines) for _ in range(10000)) + b"\n"
+            f.write(chunk)
+            written += len(chunk)
+        f.flush()
+
+        gc.collect()
+        before = resident()
+        start = time.perf_counter()
+        store = MappedLogStore(f.name)
+        # what a LogFileStream does before the first screen is drawn
+        store.index(time.monotonic() + INDEX_STEP_SECONDS)
+        first_screen = [store[i] for i in range(min(50, len(store)))]
+        first = time.perf_counter() - start
+        steps = 1
+        while not store.done:
+            store.index(time.monotonic() + INDEX_STEP_SECONDS)
+            steps += 1
+        elapsed = time.perf_counter() - start
+        last_screen = [store[i] for i in range(max(0, len(store) - 50), len(store))]
+        after = resident()
+
+        print(f"{written / 1024 / 1024:.0f} MiB, {len(store)} lines")
+        print(f"first screen after {first * 1000:.1f}ms, {len(first_screen)} lines")
+        print(
+            f"indexed in {elapsed:.2f}s, {written / elapsed / 1024 / 1024:.0f} MiB/s, {steps} steps"
+        )
+        print(
+            f"index {store.sparse.buffer_info()[1] * store.sparse.itemsize / 1024:.0f} KiB, "
+            f"resident memory grew {(after - before) / 1024 / 1024:.1f} MiB, "
+            f"last screen {len(last_screen)} lines"
+        )
+        store.close()
+
+
+def logs_export(args):
+    store = LogStore(max_bytes=None)
+    store.extend(sample_lines(args.lines, args.line_length))
+    size = sum(len(store.raw(i)) + 1 for i in range(store.start, store.end))
+    directory = tempfile.mkdtemp(prefix="dcui-bench-")
+
+    async def run():
+        # how late a 1ms timer fires while the export runs, i.e. how long the loop was held
+        lateness = []
+        done = asyncio.Event()
+
+        async def tick():
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.001)
+                lateness.append(time.perf_counter() - start - 0.001)
+
+        writer = LogExportWriter(os.path.join(directory, "bench"), compression=args.compression)
+        ticker = asyncio.ensure_future(tick())
+        start = time.perf_counter()
+        LogExport(store, writer, on_done=lambda export: done.set())
+        await done.wait()
+        elapsed = time.perf_counter() - start
+        await ticker
+        return writer, elapsed, lateness
+
+    try:
+        gc.collect()
+        before = resident()
+        writer, elapsed, lateness = asyncio.run(run())
+        after = resident()
+        lateness.sort()
+        print(f"{size / 1024 / 1024:.0f} MiB, {len(store)} lines")
+        print(
+            f"exported in {elapsed:.2f}s, {size / elapsed / 1024 / 1024:.0f} MiB/s, "
+            f"{writer.bytes / 1024 / 1024:.1f} MiB in {writer.segment + 1} segments, "
+            f"resident memory grew {(after - before) / 1024 / 1024:.1f} MiB"
+        )
+        print(
+            f"event loop held up to {lateness[-1] * 1000:.1f}ms, "
+            f"99th percentile {lateness[len(lateness) * 99 // 100] * 1000:.1f}ms"
+        )
+
+        reopened = ExportLogStore(os.path.join(directory, "bench.index"))
+        start = time.perf_counter()
+        reopened.index(0)
+        opened = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in random.sample(range(len(store)), 100):
+            assert reopened.raw(i) == store.raw(i)
+        seek = (time.perf_counter() - start) / 100
+        print(f"reopened in {opened * 1000:.1f}ms, a random line in {seek * 1000:.2f}ms")
+        reopened.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def logs_render(args):
+    plain = LogStore()
+    colored = LogStore()
+    for line in sample_lines(args.height * 4, 120):
+        plain.append(line)
+        # what a service logging with colors sends
+        colored.append(b"\x1b[32mINFO\x1b[0m \x1b[1mworker\x1b[0m " + line)
+
+    class LogsApp(App):
+        def compose(self):
+            self.logs = Logs()
+            yield self.logs
+
+    def frames(logs, store, count, cold=False):
+        logs.store = store
+        logs._seen_start = store.start
+        start = time.perf_counter()
+        for frame in range(count):
+            if cold:
+                logs._styled_lines.clear()
+            # scrolling a line per frame, like following a busy service
+            logs.scroll_to(y=frame % (len(store) - args.height), animate=False, immediate=True)
+            for y in range(args.height):
+                logs.render_line(y)
+        return (time.perf_counter() - start) / count
+
+    async def run():
+        app = LogsApp()
+        async with app.run_test(size=(args.width, args.height)):
+            logs = app.logs
+            logs.store = colored
+            logs._update_dimensions()
+            return [
+                ("plain", frames(logs, plain, args.frames)),
+                ("colors, parsed every time", frames(logs, colored, args.frames, cold=True)),
+                ("colors, cached", frames(logs, colored, args.frames)),
+            ]
+
+    print(f"{args.width}x{args.height} log pane")
+    for name, elapsed in asyncio.run(run()):
+        print(f"{name:>26}: {elapsed * 1000:6.2f}ms per frame")
+
+
+def shell_throughput(args):
+    # a child that writes text as fast as the pty takes it, like cat on a big file
+    script = (
+        "import sys\n"
+        "line = b'x' * 60 + b' some build output\\n'\n"
+        f"block = line * (65536 // len(line))\n"
+        f"for _ in range({args.megabytes} * 1024 * 1024 // len(block)):\n"
+        "    sys.stdout.buffer.write(block)\n"
+    )
+
+    class ShellApp(App):
+        def compose(self):
+            self.shell = InteractiveShell([sys.executable, "-c", script], max_fps=args.fps)
+            yield self.shell
+
+    async def run():
+        app = ShellApp()
+        # the child starts while the app is still being set up, so the clock has to start first
+        start = time.perf_counter()
+        cpu = time.process_time()
+        async with app.run_test(size=(args.width, args.height)):
+            # how late a 10ms timer fires is how long a key press would wait to be handled
+            lag = 0.0
+            while not app.shell._exited:
+                before = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lag = max(lag, time.perf_counter() - before - 0.01)
+            return time.perf_counter() - start, time.process_time() - cpu, lag
+
+    elapsed, cpu, lag = asyncio.run(run())
+    print(
+        f"{args.megabytes} MiB through a {args.width}x{args.height} pane at max {args.fps} fps: "
+        f"{elapsed:.2f}s, {args.megabytes / elapsed:.2f} MiB/s, "
+        f"{cpu:.2f}s cpu in the ui process, event loop up to {lag * 1000:.0f}ms late"
+    )
+
+
+def shell_paste(args):
+    # a raw mode child that asks for bracketed paste and reads until the paste ends, like an editor
+    script = (
+        "import os, tty\n"
+        "tty.setraw(0)\n"
+        "os.write(1, b'\\x1b[?2004h')\n"
+        "data = bytearray()\n"
+        "while not data.endswith(b'\\x1b[201~'):\n"
+        "    chunk = os.read(0, 65536)\n"
+        "    if not chunk:\n"
+        "        break\n"
+        "    data += chunk\n"
+        "os.write(1, f'read {len(data)} bytes'.encode())\n"
+    )
+    line = "select * from service_logs where level = 'error' order by time desc limit 10;\n"
+    text = line * (args.kilobytes * 1024 // len(line))
+
+    class ShellApp(App):
+        def compose(self):
+            self.shell = InteractiveShell([sys.executable, "-c", script])
+            yield self.shell
+
+    async def run():
+        app = ShellApp()
+        async with app.run_test() as pilot:
+            while not app.shell.bracketed_paste:
+                await pilot.pause(0.01)
+            for key in "typing":
+                await pilot.press(key)
+            start = time.perf_counter()
+            app.shell.post_message(events.Paste(text))
+            while not app.shell._exited:
+                await pilot.pause(0.01)
+            return time.perf_counter() - start, app.shell.input_stats
+
+    elapsed, stats = asyncio.run(run())
+    print(f"pasted {len(text) / 1024:.0f} KiB, child done reading after {elapsed:.2f}s")
+    print(stats)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parser_logs_memory = subparsers.add_parser("logs-memory", help="Log line storage memory use")
+    parser_logs_memory.add_argument("--lines", type=int, default=5_000_000)
+    parser_logs_memory.add_argument("--line-length", type=int, default=80)
+    parser_logs_memory.set_defaults(func=logs_memory)
+
+    parser_search = subparsers.add_parser("logs-search", help="Searching a log store")
+    parser_search.add_argument("--lines", type=int, default=2_000_000)
+    parser_search.add_argument("--line-length", type=int, default=80)
+    parser_search.add_argument("--pattern", default="id=1234567[.]")
+    parser_search.set_defaults(func=logs_search)
+
+    parser_file = subparsers.add_parser("logs-file", help="Opening a big log file")
+    parser_file.add_argument("--megabytes", type=int, default=1000)
+    parser_file.add_argument("--line-length", type=int, default=120)
+    parser_file.set_defaults(func=logs_file)
+
+    parser_render = subparsers.add_parser("logs-render", help="Drawing a log pane")
+    parser_render.add_argument("--frames", type=int, default=200)
+    parser_render.add_argument("--width", type=int, default=120)
+    parser_render.add_argument("--height", type=int, default=40)
+    parser_render.set_defaults(func=logs_render)
+
+    parser_export = subparsers.add_parser("logs-export", help="Exporting a log store")
+    parser_export.add_argument("--lines", type=int, default=2_000_000)
+    parser_export.add_argument("--line-length", type=int, default=80)
+    parser_export.add_argument("--compression", choices=["gzip", "lzma"], default="gzip")
+    parser_export.set_defaults(func=logs_export)
+
+    parser_shell = subparsers.add_parser(
+        "shell-throughput", help="Terminal output a shell pane can absorb"
+    )
+    parser_shell.add_argument("--megabytes", type=int, default=20)
+    parser_shell.add_argument("--fps", type=int, default=30)
+    parser_shell.add_argument("--width", type=int, default=120)
+    parser_shell.add_argument("--height", type=int, default=40)
+    parser_shell.set_defaults(func=shell_throughput)
+
+    parser_paste = subparsers.add_parser("shell-paste", help="Pasting into a shell pane")
+    parser_paste.add_argument("--kilobytes", type=int, default=200)
+    parser_paste.set_defaults(func=shell_paste)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,35 @@
 from __future__ import annotations
 
 import re
+import time
 
+from textual.binding import Binding
 from textual.reactive import Reactive
 from textual.widgets import DataTable, Static
 
 from .logs import Logs
+from ..docker_api import ONEOFF_LABEL
 from ..docker_compose import DockerCompose
 
+# status a container ends up in after an event, other events leave it alone
+EVENT_STATES = {
+    "start": "running",
+    "restart": "running",
+    "unpause": "running",
+    "pause": "paused",
+    # ps only lists running containers, so anything stopped shows up blank
+    "die": "",
+    "stop": "",
+    "destroy": "",
+}
+
+
+# columns toggled with "m", from the levels of the lines in each service's logs
+LOG_RATE_COLUMNS = ["errors/min", "warnings/min", "lines/sec"]
+LOG_RATE_INTERVAL = 1
+# lines/sec is over this many seconds, the current one is usually still filling up
+LINES_RATE_SECONDS = 10
+
 
 def format_port(port):
     if port["PublishedPort"]:
@@ -17,6 +39,16 @@ def format_port(port):
     return f"{source.replace('0.0.0.0:', '').replace(':::', '')}{port['TargetPort']}"
 
 
+def service_state(states):
+    # a service with several containers is running while any of them is
+    states = list(states)
+    return "running" if "running" in states else next(iter(states), "")
+
+
+def format_status(state, health=""):
+    return f"{state} ({health})" if state and health else state
+
+
 class DockerComposeController(DataTable):
     DEFAULT_CSS = """
         DockerComposeController {
@@ -32,9 +64,9 @@ class DockerComposeController(DataTable):
         }
     """
 
-    # BINDINGS = [
-    #     ("m", "toggle_columns()", "Toggle"),
-    # ]
+    BINDINGS = [
+        Binding("m", "toggle_log_rates", "Log rates"),
+    ]
 
     selected = Reactive(False)
 
@@ -61,6 +93,16 @@ class DockerComposeController(DataTable):
         self.docker_compose_parsed = {}
         self.docker_compose = DockerCompose(docker_file)
         self.selected_service = None
+        self.service_health = {}
+        # service -> {container id: state} of the containers ps or events said aren't stopped
+        self.service_containers = {}
+        self.status_service = None
+        # last values written per service and column, so updates only touch cells that changed
+        self.snapshot = {}
+        self.row_keys = {}
+        # the project's log stream while the log rate columns are shown
+        self.log_stream = None
+        self._log_rates_timer = None
 
         self.column_sets = [
             ["service", "status", "ports"],
@@ -77,6 +119,12 @@ class DockerComposeController(DataTable):
     def watch_selected(self, selected: bool) -> None:
         self.set_class(selected, "selected")
         self._clear_caches()
+        if selected and self.status_service:
+            self.status_service.poke(self)
+
+    @property
+    def poll_stats(self):
+        return self.status_service.schedules.get(self) if self.status_service else None
 
     # def action_toggle_columns(self):
     #     self.column_set_index = (self.column_set_index + 1) % len(self.column_sets)
@@ -88,8 +136,61 @@ class DockerComposeController(DataTable):
         # self.add_columns("service", "status", "name", "command", "ports")
         # self.display_columns = self.column_sets[self.column_set_index]
         self.call_later(self.load_docker)
-        self.call_later(self.update_docker_ps)
-        self.set_interval(5, self.update_docker_ps)
+
+    def on_unmount(self) -> None:
+        if self.status_service:
+            self.status_service.unregister(self)
+        self._stop_log_rates()
+
+    def action_toggle_log_rates(self) -> None:
+        if self.log_stream is None:
+            for column in LOG_RATE_COLUMNS:
+                self.add_column(column, key=column, default="")
+            # the same `docker compose logs` as the log panes, started if none is open
+            self.log_stream = self.screen.project_log_stream(self.docker_compose)
+            self.log_stream.subscribe(self)
+            self._log_rates_timer = self.set_interval(LOG_RATE_INTERVAL, self.update_log_rates)
+            self.update_log_rates()
+        else:
+            self._stop_log_rates()
+            for column in LOG_RATE_COLUMNS:
+                self.remove_column(column)
+            for values in self.snapshot.values():
+                for column in LOG_RATE_COLUMNS:
+                    values.pop(column, None)
+
+    def _stop_log_rates(self):
+        if self._log_rates_timer is not None:
+            self._log_rates_timer.stop()
+            self._log_rates_timer = None
+        if self.log_stream is not None:
+            self.log_stream.unsubscribe(self)
+            self.log_stream = None
+
+    def schedule_update(self):
+        # called for every batch of lines, the counts are read on a timer instead
+        pass
+
+    def update_log_rates(self):
+        now = int(time.time())
+        changes = {}
+        for service in self.row_keys:
+            stream = self.log_stream.services.get(service)
+            if stream is None:
+                # nothing logged yet, no need for a store of its own
+                changes[service] = dict.fromkeys(LOG_RATE_COLUMNS, "")
+                continue
+            levels = stream.levels
+            errors = levels.count(levels.errors, now)
+            warnings = levels.count(levels.warnings, now)
+            lines = levels.count(levels.lines, now, LINES_RATE_SECONDS) / LINES_RATE_SECONDS
+            # blank rather than 0, so the services with something to look at stand out
+            changes[service] = {
+                "errors/min": str(errors) if errors else "",
+                "warnings/min": str(warnings) if warnings else "",
+                "lines/sec": f"{lines:.1f}" if lines else "",
+            }
+        self.apply_changes(changes)
 
     def load_docker(self):
         data = self.docker_compose.load_docker_compose(self.docker_file)
@@ -101,34 +202,95 @@ class DockerComposeController(DataTable):
             or not re.search(self.skip_service_regex, x, flags=re.IGNORECASE)
         ]
         self.selected_service = rows[0][0]
-        self.add_rows(rows)
+        for row_key, row in zip(self.add_rows(rows), rows):
+            self.row_keys[row[0]] = row_key
+            self.snapshot[row[0]] = {"status": row[1], "ports": row[2]}
+
+        self.status_service = getattr(self.app, "status_service", None)
+        if self.status_service:
+            self.status_service.register(self)
+
+    def apply_event(self, event):
+        """Apply a container event to its row, returns True if a ps is needed to complete it."""
+        service = event.get("service")
+        action = event.get("action", "")
+        if service not in self.row_keys:
+            return False
+        if (event.get("attributes") or {}).get(ONEOFF_LABEL) == "True":
+            # e.g. a `docker compose run` of the service coming and going, the row is about the
+            # service's own containers
+            self.service_containers.get(service, {}).pop(event.get("id", ""), None)
+            return False
 
-    async def update_docker_ps(self):
-        data = await self.docker_compose.ps()
+        needs_ps = False
+        changes = {}
+        if action.startswith("health_status"):
+            self.service_health[service] = action.partition(":")[2].strip()
+            state = self.snapshot[service]["status"].split(" (")[0]
+        elif action in EVENT_STATES:
+            containers = self.service_containers.setdefault(service, {})
+            if EVENT_STATES[action]:
+                containers[event.get("id", "")] = EVENT_STATES[action]
+            else:
+                containers.pop(event.get("id", ""), None)
+            state = service_state(containers.values())
+            if state != "running":
+                self.service_health.pop(service, None)
+                changes["ports"] = ""
+            else:
+                # events don't carry port bindings, and a replica that stopped may have had some
+                needs_ps = True
+        else:
+            return False
 
-        row_map = {}
-        for k, row in self.rows.items():
-            row_map[self.get_cell(k, "service")] = k
-            self.update_cell(k, "status", "")
+        changes["status"] = format_status(state, self.service_health.get(service))
+        self.apply_changes({service: changes})
+        return needs_ps
 
+    def apply_changes(self, changes):
+        """Update only the cells whose value differs from the snapshot."""
+        changed = False
+        for service, values in changes.items():
+            row_key = self.row_keys.get(service)
+            if row_key is None:
+                continue
+
+            old_values = self.snapshot[service]
+            for column, value in values.items():
+                if old_values.get(column) == value:
+                    continue
+                old_values[column] = value
+                # only cells that changed get here, so keeping the widths right stays cheap
+                self.update_cell(row_key, column, value, update_width=True)
+                changed = True
+
+        if changed:
+            self._require_update_dimensions = True
+            self._clear_caches()
+
+        return changed
+
+    def update_docker_ps(self, data):
+        self.service_health = {}
+        self.service_containers = {}
+        changes = {service: {"status": "", "ports": ""} for service in self.row_keys}
         for el in data:
             service = el["Service"]
 
-            if service in row_map:
-                self.update_cell(row_map[service], "status", el["State"])
-                self.update_cell(
-                    row_map[service],
-                    "ports",
-                    " ".join(sorted(set([format_port(p) for p in el["Publishers"] or []]))),
-                    update_width=True,
-                )
+            if service in changes:
+                self.service_containers.setdefault(service, {})[el.get("ID", "")] = el["State"]
+                self.service_health[service] = el.get("Health", "")
+                changes[service] = {
+                    "status": format_status(el["State"], el.get("Health", "")),
+                    "ports": " ".join(
+                        sorted(set([format_port(p) for p in el["Publishers"] or []]))
+                    ),
+                }
                 # self.update_cell(row_map[service], "name", el["Name"])
                 # self.update_cell(row_map[service], "command",el["Command"][:20])
                 # self.update_cell(row_map[service], "port", " ".join([format_port(p) for p in el["Publishers"] or []]))
 
-        self._require_update_dimensions = True
-        self.refresh()
-        self._clear_caches()
+        return self.apply_changes(changes)
 
     def on_data_table_row_highlighted(self, message: DataTable.RowHighlighted) -> None:
         self.selected_service = self.get_cell(message.row_key, "service")
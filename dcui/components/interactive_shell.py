@@ -1,26 +1,148 @@
 import asyncio
 import os
 import pty
-import select
 import signal
-import subprocess
+import sys
+import time
+from collections import deque
+from functools import lru_cache
 
-import pyte
+from rich.segment import Segment
+from rich.style import Style
 from textual import events
 from textual.app import App
-from textual.content import Content
-from textual.widgets import Static
+from textual.geometry import Region, Size
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
 
+from .. import terminal
+from ..terminal import DEFAULT_MAX_FPS, DEFAULT_SCROLLBACK, read_frame
 
-class InteractiveShell(Static):
-    _screen = None
-    _stream = None
+# pyte's names for the 8 basic colors, bright ones are the same with a "bright" prefix
+PYTE_COLORS = {
+    "black": "black",
+    "red": "red",
+    "green": "green",
+    "brown": "yellow",
+    "blue": "blue",
+    "magenta": "magenta",
+    "cyan": "cyan",
+    "white": "white",
+}
+
+
+def pyte_color(color):
+    if color == "default":
+        return None
+    if color in PYTE_COLORS:
+        return PYTE_COLORS[color]
+    if color.startswith("bright") and color[6:] in PYTE_COLORS:
+        return f"bright_{PYTE_COLORS[color[6:]]}"
+    # 256 color and truecolor cells are hex
+    return f"#{color}"
+
+
+@lru_cache(maxsize=1024)
+def pyte_style(fg, bg, bold, italics, underscore, strikethrough, reverse):
+    return Style(
+        color=pyte_color(fg),
+        bgcolor=pyte_color(bg),
+        bold=bold,
+        italic=italics,
+        underline=underscore,
+        strike=strikethrough,
+        reverse=reverse,
+    )
+
+
+def render_runs(runs, columns):
+    """Turn the emulator's runs of same styled cells into a Strip."""
+    return Strip([Segment(text, pyte_style(*style)) for text, style in runs], columns)
+
+
+class Scrollback:
+    """Lines that scrolled off the top of a shell pane, oldest first and at most max_lines of them.
+
+    Unstyled lines are kept as a plain str, others as runs of (text, style) with one shared tuple
+    per distinct style, and a line is only turned into a Strip when it is on screen.
+    """
+
+    def __init__(self, max_lines=DEFAULT_SCROLLBACK):
+        self.lines = deque(maxlen=max_lines)
+        # how many lines have been dropped off the front, so views can keep their place
+        self.dropped = 0
+        self._styles = {}
+
+    def __len__(self):
+        return len(self.lines)
+
+    def extend(self, lines):
+        for line in lines:
+            if not isinstance(line, str):
+                line = tuple((text, self._styles.setdefault(style, style)) for text, style in line)
+            if len(self.lines) == self.lines.maxlen:
+                self.dropped += 1
+            self.lines.append(line)
+
+    def strip(self, index, width):
+        line = self.lines[index]
+        if isinstance(line, str):
+            strip = Strip([Segment(line)])
+        else:
+            strip = Strip([Segment(text, pyte_style(*style)) for text, style in line])
+        return strip.crop_extend(0, width, None)
+
+
+class InputStats:
+    """Time from a key or paste event until the last of its bytes went into the pty."""
+
+    def __init__(self):
+        self.keys = 0
+        self.total_key_latency = 0.0
+        self.max_key_latency = 0.0
+        self.pastes = 0
+        self.paste_bytes = 0
+        self.paste_seconds = 0.0
+
+    def __repr__(self):
+        return (
+            f"InputStats(keys={self.keys}, avg_key_latency={self.avg_key_latency * 1000:.1f}ms, "
+            f"max_key_latency={self.max_key_latency * 1000:.1f}ms, pastes={self.pastes}, "
+            f"paste_throughput={self.paste_throughput / 1024:.0f}KiB/s)"
+        )
+
+    @property
+    def avg_key_latency(self):
+        return self.total_key_latency / self.keys if self.keys else 0.0
+
+    @property
+    def paste_throughput(self):
+        return self.paste_bytes / self.paste_seconds if self.paste_seconds else 0.0
+
+    def record(self, latency, paste, nbytes):
+        if paste:
+            self.pastes += 1
+            self.paste_bytes += nbytes
+            self.paste_seconds += latency
+        else:
+            self.keys += 1
+            self.total_key_latency += latency
+            self.max_key_latency = max(self.max_key_latency, latency)
+
+
+class InteractiveShell(ScrollView):
     _pty = _tty = None
+    _exited = False
+    _writing = False
+    bracketed_paste = False
 
     DEFAULT_CSS = """
     InteractiveShell {
         width: 100%;
         height: 100%;
+        overflow-x: hidden;
+        scrollbar-gutter: stable;
+        scrollbar-size-vertical: 1;
     }"""
 
     def __init__(
@@ -30,12 +152,13 @@ class InteractiveShell(Static):
         exit_command=None,
         exit_message=True,
         focus=True,
+        max_fps=DEFAULT_MAX_FPS,
+        scrollback=DEFAULT_SCROLLBACK,
         name: str | None = None,
         id: str | None = None,
         classes: str | None = None,
     ) -> None:
         super().__init__(
-            "",
             name=name,
             id=id,
             classes=classes,
@@ -45,7 +168,23 @@ class InteractiveShell(Static):
         self.exit_message = exit_message
         self._focus = focus
         self.process = None
+        # dcui.terminal, which reads the pty and runs pyte so this loop doesn't have to
+        self.emulator = None
         self.env = env
+        # one strip per screen line, replaced as the emulator sends the lines that changed
+        self._strips = []
+        # and above them whatever scrolled off the top, which stays around after the process exits
+        self.scrollback = Scrollback(scrollback)
+        self._seen_dropped = 0
+        self.max_fps = max_fps
+        # input waiting for the child to read it, written whenever the pty has room so a child
+        # that isn't reading can't block the UI
+        self._outgoing = bytearray()
+        self._queued = 0
+        self._written = 0
+        # (queued total at the end of it, time of the event, is a paste, size) for each write
+        self._pending_writes = deque()
+        self.input_stats = InputStats()
 
     async def on_mount(self):
         if self._focus:
@@ -57,80 +196,210 @@ class InteractiveShell(Static):
         print("onkey", event.key)
         if event.key in ["ctrl+]", "ctrl+_"]:
             return
+        elif event.key == "shift+pageup":
+            self.scroll_page_up(animate=False)
+        elif event.key == "shift+pagedown":
+            self.scroll_page_down(animate=False)
         elif event.character:
-            os.write(self._pty, event.character.encode("utf-8"))
+            self._write(event.character.encode("utf-8"), event.time)
         elif event.key == "up":
-            os.write(self._pty, "".join([chr(0x1B), chr(0x5B), chr(0x41)]).encode("utf-8"))
+            self._write("".join([chr(0x1B), chr(0x5B), chr(0x41)]).encode("utf-8"), event.time)
         elif event.key == "down":
-            os.write(self._pty, "".join([chr(0x1B), chr(0x5B), chr(0x42)]).encode("utf-8"))
+            self._write("".join([chr(0x1B), chr(0x5B), chr(0x42)]).encode("utf-8"), event.time)
         elif event.key == "left":
-            os.write(self._pty, "".join([chr(0x1B), chr(0x5B), chr(0x44)]).encode("utf-8"))
+            self._write("".join([chr(0x1B), chr(0x5B), chr(0x44)]).encode("utf-8"), event.time)
         elif event.key == "right":
-            os.write(self._pty, "".join([chr(0x1B), chr(0x5B), chr(0x43)]).encode("utf-8"))
+            self._write("".join([chr(0x1B), chr(0x5B), chr(0x43)]).encode("utf-8"), event.time)
 
         event.stop()
 
-    def on_unmount(self):
-        if self.process:
-            print("terminate", self.process.pid, self.process)
+    def on_paste(self, event: events.Paste) -> None:
+        # like a terminal, enter is a carriage return
+        text = event.text.replace("\r\n", "\r").replace("\n", "\r")
+        if self.bracketed_paste:
+            # so the pasted text can't end the paste early
+            text = "\x1b[200~" + text.replace("\x1b[201~", "") + "\x1b[201~"
+        self._write(text.encode("utf-8"), event.time, paste=True)
+        event.stop()
+
+    def _write(self, data, started, paste=False):
+        if self._pty is None or self._exited:
+            return
+        self._outgoing += data
+        self._queued += len(data)
+        self._pending_writes.append((self._queued, started, paste, len(data)))
+        self._flush()
+
+    def _flush(self):
+        while self._outgoing:
             try:
-                os.killpg(os.getpgid(self.process.pid), signal.SIGTERM)
-            except Exception as e:
-                print("Failed to kill", self.process, e)
+                written = os.write(self._pty, self._outgoing)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                # the child is gone, nobody is going to read it
+                print("pty write failed", e)
+                self._outgoing.clear()
+                self._pending_writes.clear()
+                break
+            del self._outgoing[:written]
+            self._written += written
+
+        now = time.monotonic()
+        while self._pending_writes and self._pending_writes[0][0] <= self._written:
+            _, started, paste, size = self._pending_writes.popleft()
+            self.input_stats.record(now - started, paste, size)
+
+        if self._outgoing and not self._writing:
+            asyncio.get_running_loop().add_writer(self._pty, self._flush)
+            self._writing = True
+        elif not self._outgoing:
+            self._stop_writing()
+
+    def _stop_writing(self):
+        if self._writing:
+            asyncio.get_running_loop().remove_writer(self._pty)
+            self._writing = False
+
+    def on_unmount(self):
+        self._stop_writing()
+        for process in [self.process, self.emulator]:
+            if process and process.returncode is None:
+                print("terminate", process.pid, process)
+                try:
+                    os.killpg(process.pid, signal.SIGTERM)
+                except Exception as e:
+                    print("Failed to kill", process, e)
+        if self._pty is not None:
+            os.close(self._pty)
+            self._pty = None
 
     async def _run(self):
         print("run", self.command)
         self._pty, self._tty = pty.openpty()
-        self.process = subprocess.Popen(
-            self.command,
+        os.set_blocking(self._pty, False)
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command,
             stdin=self._tty,
             stdout=self._tty,
             stderr=self._tty,
             start_new_session=True,
             env=self.env,
         )
-        self._screen = pyte.Screen(self.size[1], self.size[0])
-        self._stream = pyte.Stream(self._screen)
-        print("await run_check")
-        await self._run_check()
-
-    async def _run_check(self):
-        return_code = self.process.poll()
-        if return_code is not None:
-            print("process is gone, quitting")
-            if self.exit_command:
-                self.exit_command()
-
-            exit_message = [
-                f"process ended return_code={return_code}",
-            ]
-            if self.exit_message:
-                exit_message += ["Press escape to close"]
-
-            print(exit_message)
-            screen = [x for x in self._screen.display if x.strip()] + exit_message
-            print(screen)
-            self.update(Content("\n".join(screen)))
-            self.refresh()
+        # the child has its own copy, closing ours lets reads fail with EIO once it's gone
+        os.close(self._tty)
+        self._tty = None
+
+        # the pty is the width left over by the scrollbar
+        w, h = self.scrollable_content_region.size
+        self.emulator = await asyncio.create_subprocess_exec(
+            # by path, so the process doesn't import all of dcui and textual
+            sys.executable,
+            terminal.__file__,
+            str(self._pty),
+            str(w),
+            str(h),
+            str(self.max_fps),
+            str(self.scrollback.lines.maxlen),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            pass_fds=[self._pty],
+            start_new_session=True,
+        )
+        self._frames = self.run_worker(self._read_frames(), exclusive=True, group="emulator")
+        self.run_worker(self._wait_for_exit(), exclusive=True, group="shell")
+
+    def _send(self, command):
+        if (
+            self.emulator
+            and self.emulator.returncode is None
+            and not self.emulator.stdin.is_closing()
+        ):
+            self.emulator.stdin.write(command.encode() + b"\n")
+
+    async def _read_frames(self):
+        while True:
+            frame = await read_frame(self.emulator.stdout)
+            if frame is None:
+                return
+            self._apply_frame(*frame)
+
+    def _apply_frame(self, lines, columns, changed, history, bracketed_paste, final):
+        if self._exited:
             return
+        self.bracketed_paste = bracketed_paste
+        if len(self._strips) != lines:
+            self._strips = [Strip.blank(columns)] * lines
+        for y, runs in changed.items():
+            self._strips[y] = render_runs(runs, columns)
 
-        r, _, _ = select.select([self._pty], [], [], 0)
-        if self._pty in r:
-            output = os.read(self._pty, 10240)
+        if history or self.virtual_size.height != len(self.scrollback) + len(self._strips):
+            self.scrollback.extend(history)
+            self._update_dimensions()
+        else:
+            # only the lines that changed, where they are in the scrolled view
+            top = len(self.scrollback) - self.scroll_offset.y
+            for y in changed:
+                self.refresh(Region(0, top + y, columns, 1))
+
+    def _update_dimensions(self):
+        following = self.scroll_y >= self.max_scroll_y
+        dropped = self.scrollback.dropped - self._seen_dropped
+        self._seen_dropped = self.scrollback.dropped
 
-            w, h = self.size
-            if self._screen.columns != w or self._screen.lines != h:
-                self._screen.resize(h, w)
+        width = self.scrollable_content_region.width
+        self.virtual_size = Size(width, len(self.scrollback) + len(self._strips))
+        self._refresh_scrollbars()
+        if following:
+            self.scroll_to(y=self.max_scroll_y, animate=False, immediate=True)
+        elif dropped:
+            # keep the lines being looked at in place as older ones are dropped
+            self.scroll_to(y=max(0, self.scroll_y - dropped), animate=False, immediate=True)
+        self.refresh()
 
-            # print(repr(self._screen.buffer))
+    def on_resize(self, event: events.Resize) -> None:
+        w, h = self.scrollable_content_region.size
+        if w and h:
+            self._send(f"resize {w} {h}")
 
-            self._stream.feed(output.decode())
-            self.update(Content("\n".join(self._screen.display)))
-            self._screen.dirty.clear()
+    def render_line(self, y: int) -> Strip:
+        y += self.scroll_offset.y
+        if y < len(self.scrollback):
+            strip = self.scrollback.strip(y, self.scrollable_content_region.width)
+        elif y - len(self.scrollback) < len(self._strips):
+            strip = self._strips[y - len(self.scrollback)]
         else:
-            await asyncio.sleep(1 / 100.0)
+            return Strip.blank(self.size.width, self.rich_style)
+        # apply_style caches its result, so steady state redraws don't rebuild anything
+        return strip.apply_style(self.rich_style)
+
+    async def _wait_for_exit(self):
+        return_code = await self.process.wait()
+        print("process is gone, quitting")
+        # the emulator reads whatever the child wrote right before exiting and sends the whole
+        # screen as its last frame
+        self._send("close")
+        await self._frames.wait()
+        await self.emulator.wait()
+        self._exited = True
+        # input the child never read
+        self._stop_writing()
+        self._outgoing.clear()
+
+        if self.exit_command:
+            self.exit_command()
+
+        exit_message = [
+            f"process ended return_code={return_code}",
+        ]
+        if self.exit_message:
+            exit_message += ["Press escape to close"]
 
-        self.call_later(self._run_check)
+        print(exit_message)
+        self._strips = [strip for strip in self._strips if strip.text.strip()] + [
+            Strip([Segment(line)]) for line in exit_message
+        ]
+        self._update_dimensions()
 
 
 class TestApp(App):
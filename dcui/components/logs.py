@@ -1,19 +1,77 @@
+import asyncio
 import os
-from typing import Iterable
+import re
+import time
 
 from rich.segment import Segment
+from rich.style import Style
+from rich.text import Text
 from textual import events
+from textual.binding import Binding
+from textual.cache import LRUCache
 from textual.geometry import Size
 from textual.scroll_view import ScrollView
 from textual.strip import Strip
+from textual.widgets import Input
 
-from ..utils import stream_stdout_and_stderr
-import signal
+from ..log_export import INDEX_SUFFIX, LogExport, LogExportWriter
+from ..log_search import SEARCH_STEP_SECONDS, FilteredLogStore, LogSearch, compile_search
+from ..log_store import LogStore
+from ..log_streams import LogStream
+from ..log_wrap import WRAP_STEP_SECONDS, WrapIndex
+
+# how often new output is applied to a log pane, at most
+MAX_UPDATES_PER_SECOND = 30
+
+# lines with escape codes or wide characters whose rendering is kept, by their text
+STYLED_LINE_CACHE_SIZE = 4096
+
+MATCH_STYLE = Style(reverse=True)
+CURRENT_MATCH_STYLE = Style(color="black", bgcolor="yellow")
+
+
+class LogSearchBar(Input):
+    """Where the pattern for searching a Logs goes, the search follows what's typed."""
+
+    DEFAULT_CSS = """
+        LogSearchBar {
+            dock: bottom;
+        }
+    """
+
+    def __init__(self, logs):
+        super().__init__(placeholder="search (regex)")
+        self.logs = logs
+
+    def on_input_changed(self, event: Input.Changed) -> None:
+        event.stop()
+        self.logs.set_search(event.value)
+
+    def on_input_submitted(self, event: Input.Submitted) -> None:
+        event.stop()
+        self.logs.focus()
+        self.logs.action_next_match()
+
+    def on_key(self, event: events.Key) -> None:
+        if event.key == "escape":
+            event.stop()
+            self.logs.clear_search()
 
 
 class Logs(ScrollView):
+    BINDINGS = [
+        Binding("slash", "search", "Search"),
+        Binding("n", "next_match", "Next match", show=False),
+        Binding("N", "previous_match", "Previous match", show=False),
+        Binding("f", "toggle_filter", "Filter"),
+        Binding("w", "toggle_wrap", "Wrap"),
+        Binding("e", "export", "Export"),
+        Binding("E", "toggle_tee", "Tee", show=False),
+    ]
+
     def __init__(
         self,
+        store: LogStore | None = None,
         name: str | None = None,
         id: str | None = None,
         classes: str | None = None,
@@ -24,87 +82,452 @@ class Logs(ScrollView):
             classes=classes,
         )
         print(f"new logs name={name}")
-        self.data = []
+        self.store = store if store is not None else LogStore()
+        # the store being shown can be just the lines matching the search
+        self.unfiltered_store = self.store
+        self.search = None
+        self.search_bar = None
+        # unfiltered line number of the match n and N go from
+        self.current_match = None
+        self._highlight = None
+        self._search_wakeup = None
+        self._search_status = 0.0
+        self._styled_lines = LRUCache(STYLED_LINE_CACHE_SIZE)
+        self._styled_lines_style = None
+        self.wrap = False
+        # rows of the wrapped lines, None until it's built, and the first row when last updated
+        self.wrap_index = None
+        self._wrap_building = None
+        self._seen_top = 0
+        # exports being written, one of them may be a tee of everything that comes in
+        self.exports = []
+        self.tee = None
         self._require_update_dimensions: bool = False
-        self._new_rows: set[int] = set()
-        self._content_width = 0
+        self._seen_start = self.store.start
+        self._seen_end = self.store.end
         self._scroll_target = None
+        self._update_scheduled = False
+        self._last_update = 0.0
 
     def add_log(self, line, source=None):
-        row_index = len(self.data)
-
-        self.data.append(line)
-        self._new_rows.add(row_index)
+        self.store.append(line)
         self._require_update_dimensions = True
         self.check_idle()
-        # self.update("\n".join(self.data))
 
     def on_idle(self) -> None:
         if self._require_update_dimensions:
             self._require_update_dimensions = False
-            new_rows = self._new_rows.copy()
-            self._new_rows.clear()
-            self._update_dimensions(new_rows)
-            if self._scroll_target is None:
-                self.scroll_to(y=len(self.data) - 1, animate=False)
-                self._refresh_scrollbars()
-
-    def _update_dimensions(self, new_rows: Iterable[int]) -> None:
+            self._update_dimensions()
+
+    def schedule_update(self):
+        # one dimension update and refresh per frame, however many reads came in
+        if self._update_scheduled:
+            return
+        self._update_scheduled = True
+        delay = self._last_update + 1 / MAX_UPDATES_PER_SECOND - time.monotonic()
+        if delay > 0:
+            self.set_timer(delay, self._apply_update)
+        else:
+            # textual's timers can't take a 0 delay
+            self.call_later(self._apply_update)
+
+    def _apply_update(self):
+        self._update_scheduled = False
+        self._last_update = time.monotonic()
+        self._update_dimensions()
+
+    def _update_dimensions(self) -> None:
         """Called to recalculate the virtual (scrollable) size."""
+        following = self._scroll_target is None and self.scroll_y >= self.max_scroll_y
+        evicted = self.store.start - self._seen_start
+        self._seen_start = self.store.start
+        self._seen_end = self.store.end
 
-        new_content_width = max([len(self.data[l]) for l in new_rows])
-        self._content_width = max(new_content_width, self._content_width)
-        self.virtual_size = Size(self._content_width, len(self.data))
+        index = self.wrap_index
+        if index is not None and index.store is not self.store:
+            self.wrap_index = index = None
+        if self.wrap and (index is None or index.stale):
+            # shown unwrapped, or with the old rows, until the new ones are ready
+            self._rewrap()
+        if index is not None:
+            # only lines added since the last update are wrapped here
+            index.extend()
+            evicted = index.top - self._seen_top
+            self._seen_top = index.top
+            self.virtual_size = Size(index.width, index.bottom - index.top)
+        else:
+            self.virtual_size = Size(self.store.content_width, len(self.store))
+        self._refresh_scrollbars()
+        if following:
+            self.scroll_to(y=self.virtual_size.height - 1, animate=False, immediate=True)
+        elif evicted:
+            # keep the lines being looked at in place as older ones are dropped
+            self.scroll_to(y=max(0, self.scroll_y - evicted), animate=False, immediate=True)
+        self.refresh()
+        if self._search_wakeup is not None:
+            # the search keeps up with new lines
+            self._search_wakeup.set()
+        if self.tee is not None:
+            self.tee.schedule_update()
 
     def render_line(self, y: int) -> Strip:
-        width, height = self.size
+        width = self.size.width
         scroll_x, scroll_y = self.scroll_offset
-        try:
-            line = self.data[scroll_y + y]
-        except IndexError:
-            line = ""
+        if self.wrap_index is not None:
+            return self._render_wrapped_line(self._seen_top + scroll_y + y, width)
+        index = self._seen_start + scroll_y + y
+        return self._render_line(self.store.get(index), index, scroll_x, width)
+
+    def _render_wrapped_line(self, row, width):
+        located = self.wrap_index.locate(row)
+        if located is None:
+            return Strip([Segment(" " * width, self.rich_style)])
+        index, line_row = located
+        wrap_width = self.wrap_index.width
+        strip = self._render_line(
+            self.store.get(index), index, line_row * wrap_width, wrap_width
+        )
+        return strip.extend_cell_length(width, self.rich_style).crop(0, width)
+
+    def _render_line(self, line, index, scroll_x, width):
+        # the cells of line from scroll_x, width wide
+        if "\x1b" in line or not line.isascii():
+            return self._render_styled_line(line, index, scroll_x, width)
 
         text = line[scroll_x: scroll_x + width]
         missing_len = max(0, width - len(text))
 
-        return Strip([Segment(text + " " * missing_len, self.rich_style)])
+        if self._highlight is None or not text:
+            return Strip([Segment(text + " " * missing_len, self.rich_style)])
+
+        style = self.rich_style
+        match_style = style + (
+            CURRENT_MATCH_STYLE if self._line_number(index) == self.current_match else MATCH_STYLE
+        )
+        segments = []
+        position = scroll_x
+        for match in self._highlight.finditer(line):
+            if match.start() >= scroll_x + width:
+                break
+            start, end = max(match.start(), scroll_x), min(match.end(), scroll_x + width)
+            if start >= end:
+                continue
+            if start > position:
+                segments.append(Segment(line[position:start], style))
+            segments.append(Segment(line[start:end], match_style))
+            position = end
+        segments.append(Segment(line[position: scroll_x + width] + " " * missing_len, style))
+        return Strip(segments)
+
+    def _render_styled_line(self, line, index, scroll_x, width):
+        # colors are parsed once, the first time a line is shown, and cropped by cells rather
+        # than characters so wide ones scroll right
+        style = self.rich_style
+        if style != self._styled_lines_style:
+            self._styled_lines.clear()
+            self._styled_lines_style = style
+
+        if self._highlight is None:
+            strip = self._styled_lines.get(line)
+            if strip is None:
+                strip = self._styled_strip(Text.from_ansi(line, end=""), style)
+                self._styled_lines.set(line, strip)
+        else:
+            # only while searching, and only for the lines on screen
+            text = Text.from_ansi(line, end="")
+            current = self._line_number(index) == self.current_match
+            match_style = CURRENT_MATCH_STYLE if current else MATCH_STYLE
+            for match in self._highlight.finditer(text.plain):
+                text.stylize(match_style, match.start(), match.end())
+            strip = self._styled_strip(text, style)
+
+        return strip.crop(scroll_x, scroll_x + width).extend_cell_length(width, style)
+
+    def _styled_strip(self, text, style):
+        return Strip(text.render(self.app.console)).apply_style(style)
+
+    def _line_number(self, index):
+        # the unfiltered line shown at index
+        if self.store is self.unfiltered_store:
+            return index
+        try:
+            return self.search.line(index)
+        except IndexError:
+            return None
+
+    def _show(self, store):
+        self.store = store
+        self._seen_start = store.start
+        self._seen_end = store.end
+        self._update_dimensions()
+
+    def _scroll_to_line(self, index, middle=True):
+        # somewhere near the middle rather than at an edge
+        if self.wrap_index is not None:
+            y = self.wrap_index.row_of(index) - self._seen_top
+        else:
+            y = index - self.store.start
+        if middle:
+            y -= self.scrollable_content_region.height // 2
+        self.scroll_to(y=max(0, y), animate=False, immediate=True)
+        self.refresh()
+
+    def _top_line(self):
+        # the store's line at the top of the pane
+        if self.wrap_index is not None:
+            located = self.wrap_index.locate(self._seen_top + int(self.scroll_y))
+            return located[0] if located is not None else self.store.start
+        return self._seen_start + int(self.scroll_y)
+
+    def on_resize(self, event: events.Resize) -> None:
+        if self.wrap:
+            self._rewrap()
+
+    def action_toggle_wrap(self) -> None:
+        self.wrap = not self.wrap
+        if self.wrap:
+            self._rewrap()
+            return
+        line = self._top_line()
+        self.workers.cancel_group(self, "log-wrap")
+        self._wrap_building = None
+        self.wrap_index = None
+        self._update_dimensions()
+        self._scroll_to_line(line, middle=False)
+
+    def _rewrap(self):
+        width = self.scrollable_content_region.width
+        current = self._wrap_building or self.wrap_index
+        if width <= 0 or (
+            current is not None
+            and current.store is self.store
+            and current.width == width
+            and not current.stale
+        ):
+            return
+        self._wrap_building = WrapIndex(self.store, width)
+        self.run_worker(self._build_wrap(self._wrap_building), group="log-wrap", exclusive=True)
+
+    async def _build_wrap(self, index):
+        # a few milliseconds at a time, a big store takes a while to wrap at a new width
+        while not index.extend(time.monotonic() + WRAP_STEP_SECONDS):
+            await asyncio.sleep(0)
+        if self._wrap_building is not index or index.store is not self.store:
+            return
+        following = self._scroll_target is None and self.scroll_y >= self.max_scroll_y
+        line = self._top_line()
+        self._wrap_building = None
+        self.wrap_index = index
+        self._seen_top = index.top
+        self._update_dimensions()
+        if not following:
+            self._scroll_to_line(line, middle=False)
+
+    def action_search(self) -> None:
+        if self.search_bar is None:
+            self.search_bar = LogSearchBar(self)
+            self.parent.mount(self.search_bar)
+        self.search_bar.focus()
+
+    def set_search(self, text):
+        try:
+            pattern = compile_search(text) if text else None
+            self._highlight = re.compile(text) if text else None
+        except re.error:
+            # keep going with the last good one until the pattern is fixed
+            self.search_bar.border_subtitle = "bad pattern"
+            return
+
+        self.workers.cancel_group(self, "log-search")
+        self._search_wakeup = None
+        self.current_match = None
+        if pattern is None:
+            self.search = None
+            self._show(self.unfiltered_store)
+            self.search_bar.border_subtitle = ""
+            return
+
+        self.search = LogSearch(self.unfiltered_store, pattern)
+        if self.store is not self.unfiltered_store:
+            self._show(FilteredLogStore(self.search))
+        self.refresh()
+        self.run_worker(self._run_search(self.search), group="log-search", exclusive=True)
+
+    def clear_search(self):
+        if self.search_bar is not None:
+            self.search_bar.remove()
+            self.search_bar = None
+        self.workers.cancel_group(self, "log-search")
+        self._search_wakeup = None
+        self._highlight = None
+        self.search = None
+        self.current_match = None
+        if self.store is not self.unfiltered_store:
+            self._show(self.unfiltered_store)
+        self.refresh()
+        self.focus()
+
+    async def _run_search(self, search):
+        # a few milliseconds at a time, so typing and drawing carry on while a big store is
+        # searched, then again whenever lines come in
+        self._search_wakeup = wakeup = asyncio.Event()
+        while True:
+            found = search.scan(time.monotonic() + SEARCH_STEP_SECONDS)
+            if found and self.store is not self.unfiltered_store:
+                self.schedule_update()
+            if search.done or time.monotonic() - self._search_status > 0.1:
+                self._search_status = time.monotonic()
+                self._show_search_status(search)
+            if search.done:
+                wakeup.clear()
+                await wakeup.wait()
+            else:
+                await asyncio.sleep(0)
+
+    def _show_search_status(self, search):
+        if self.search_bar is None:
+            return
+        status = f"{len(search)} matches"
+        if not search.done:
+            status += f", {search.progress:.0%} searched"
+        self.search_bar.border_subtitle = status
+
+    def _reference_line(self):
+        if self.current_match is not None:
+            return self.current_match
+        line = self._line_number(self._top_line())
+        return line if line is not None else self.unfiltered_store.start
+
+    def _go_to_match(self, number):
+        if number is None:
+            self.app.bell()
+            return
+        self.current_match = self.search.line(number)
+        if self.store is self.unfiltered_store:
+            self._scroll_to_line(self.current_match)
+        else:
+            self._scroll_to_line(number)
+
+    def action_next_match(self) -> None:
+        if self.search is not None:
+            if self.current_match is None:
+                # the first one on screen or after it
+                line = self._reference_line()
+                self._go_to_match(self.search.next(line - 1))
+            else:
+                self._go_to_match(self.search.next(self.current_match))
+
+    def action_previous_match(self) -> None:
+        if self.search is not None:
+            self._go_to_match(self.search.previous(self._reference_line()))
+
+    def action_toggle_filter(self) -> None:
+        if self.search is None:
+            return
+        line = self._reference_line()
+        if self.store is self.unfiltered_store:
+            self._show(FilteredLogStore(self.search))
+            self._scroll_to_line(self.search.number(line))
+        else:
+            self._show(self.unfiltered_store)
+            self._scroll_to_line(line)
+
+    def action_export(self) -> None:
+        # what's shown, so with a filter on just the matching lines
+        export = self._start_export(self.store, follow=False)
+        if export is not None:
+            self.notify(f"exporting {len(self.store)} lines to {export.writer.base}.*")
+
+    def action_toggle_tee(self) -> None:
+        if self.tee is not None:
+            # done once what's come in so far is written
+            self.tee.close()
+            return
+        self.tee = self._start_export(self.unfiltered_store, follow=True)
+        if self.tee is not None:
+            self.notify(f"writing everything to {self.tee.writer.base}.*")
+
+    def _start_export(self, store, follow):
+        options = dict(getattr(self.app, "log_export_options", None) or {})
+        directory = options.pop("directory", None) or os.getcwd()
+        # named after the pane, e.g. "web-logs-20240101-120000"
+        title = getattr(self.parent, "title", None) or self.name or "logs"
+        name = re.sub(r"[^\w.]+", "-", str(title)).strip("-")
+        stem = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}"
+        base = os.path.join(directory, stem)
+        count = 1
+        # another export from the same pane within the second
+        while os.path.exists(base + INDEX_SUFFIX):
+            count += 1
+            base = os.path.join(directory, f"{stem}-{count}")
+        try:
+            writer = LogExportWriter(base, **options)
+        except OSError as e:
+            self.notify(f"can't export to {base}: {e}", severity="error")
+            return None
+        export = LogExport(store, writer, follow=follow, on_done=self._export_done)
+        self.exports.append(export)
+        return export
 
+    def _export_done(self, export):
+        if export in self.exports:
+            self.exports.remove(export)
+        if export is self.tee:
+            self.tee = None
+        if not self.is_attached:
+            return
+        if export.error is not None:
+            self.notify(f"writing {export.writer.base} failed: {export.error}", severity="error")
+            return
+        message = f"{export.writer.lines} lines written to {export.writer.base}.*"
+        if export.skipped:
+            message += f", {export.skipped} were dropped before they could be"
+        self.notify(message)
+
+    def close_exports(self):
+        # they still write what the store has now
+        for export in list(self.exports):
+            export.close()
+
+    def on_unmount(self):
+        self.close_exports()
+
+
+class StreamLogs(Logs):
+    """A view on a LogStream, which may be shared with other panes."""
 
-class CommandLogger(Logs):
     def __init__(
         self,
-        command,
-        exit_message=True,
-        exit_command=None,
+        stream: LogStream,
         name: str | None = None,
         id: str | None = None,
         classes: str | None = None,
     ) -> None:
         super().__init__(
+            store=stream.store,
             name=name,
             id=id,
             classes=classes,
         )
-        self.command = command
-        self.process = None
-        self.data = []
-        self._require_update_dimensions: bool = False
-        self._new_rows: set[int] = set()
-        self._content_width = 0
-        self._scroll_target = None
-        self._callback_timer = None
-        self.exit_command = exit_command
-        self.exit_message = exit_message
+        self.stream = stream
         self.can_focus = True
 
     async def on_mount(self) -> None:
-        print("running self.command", self.command)
-        self.add_log(f"running {self.command}")
-        self.process = stream_stdout_and_stderr(self.command, callback=lambda a, b: self.add_log(b.strip(), source=a))
-        self._callback_timer = self.set_interval(1, self.check_process, name="check_process")
+        self.stream.subscribe(self)
         self.focus()
+        if getattr(self.app, "log_tee", False):
+            self.action_toggle_tee()
+
+    def watch_scroll_y(self, old_value: float, new_value: float) -> None:
+        super().watch_scroll_y(old_value, new_value)
+        if new_value == 0 and old_value > 0:
+            # the stream may have older lines than the ones it started with
+            self.stream.backfill()
 
     def on_key(self, event: events.Key) -> None:
+        if event.key in ["up", "pageup", "home"] and self.scroll_y == 0:
+            self.stream.backfill()
+
         # suppress any keys the parent uses - fix this to be dynamic
         if event.key not in ["x", "q", "t", "m", "l", "s", "r", "u", "d", "b", "ctrl+l", "ctrl+d", "ctrl+u", "ctrl+b"]:
             return
@@ -112,24 +535,43 @@ class CommandLogger(Logs):
         event.stop()
 
     def on_unmount(self):
-        if self.process:
-            print("terminate", self.process.pid, self.process)
-            try:
-                os.killpg(os.getpgid(self.process.pid), signal.SIGTERM)
-            except Exception as e:
-                print("Failed to kill", self.process, e)
-
-    async def check_process(self):
-        if not self.process:
-            return
+        # exports still writing keep the stream and its store until they're done, the last view
+        # to go takes the command and the store with it
+        for export in self.exports:
+            self.stream.subscribe(export)
+        self.close_exports()
+        self.stream.unsubscribe(self)
 
-        return_code = self.process.poll()
-        if return_code is not None:
-            if self.exit_command:
-                self.exit_command()
+    def _export_done(self, export):
+        super()._export_done(export)
+        if export in self.stream.views:
+            self.stream.unsubscribe(export)
+
+
+class CommandLogger(StreamLogs):
+    def __init__(
+        self,
+        command,
+        exit_message=True,
+        exit_command=None,
+        store: LogStore | None = None,
+        name: str | None = None,
+        id: str | None = None,
+        classes: str | None = None,
+    ) -> None:
+        stream = LogStream(command, store=store, exit_message=exit_message)
+        if exit_command:
+            stream.exit_callbacks.append(exit_command)
+        super().__init__(
+            stream,
+            name=name,
+            id=id,
+            classes=classes,
+        )
+        self.command = command
+        self.exit_command = exit_command
+        self.exit_message = exit_message
 
-            self.add_log(f"process ended return_code={return_code}")
-            if self.exit_message:
-                self.add_log("Press escape to close")
-            # self.process = None
-            self._callback_timer.stop()
+    @property
+    def process(self):
+        return self.stream.process
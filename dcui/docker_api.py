@@ -0,0 +1,265 @@
+import asyncio
+import json
+import os
+from urllib.parse import quote
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+
+PROJECT_LABEL = "com.docker.compose.project"
+SERVICE_LABEL = "com.docker.compose.service"
+# set to "True" on the containers of `docker compose run`
+ONEOFF_LABEL = "com.docker.compose.oneoff"
+
+
+class DockerApiError(Exception):
+    def __init__(self, method: str, path: str, status: int, body: bytes = b""):
+        self.method = method
+        self.path = path
+        self.status = status
+        self.body = body
+        super().__init__(
+            f"Docker API request `{method} {path}` failed with status {status}: "
+            f"{body.decode(errors='replace').strip()}"
+        )
+
+
+def socket_path_from_env():
+    docker_host = os.environ.get("DOCKER_HOST", "")
+    if docker_host.startswith("unix://"):
+        return docker_host.removeprefix("unix://")
+    if docker_host:
+        # tcp:// and ssh:// hosts are left to the docker cli
+        return None
+    return DEFAULT_SOCKET
+
+
+def label_filters(project=None, services=None, labels=None):
+    labels = list(labels or [])
+    if project:
+        labels.append(f"{PROJECT_LABEL}={project}")
+    for service in services or []:
+        labels.append(f"{SERVICE_LABEL}={service}")
+    return {"label": labels}
+
+
+def split_health(status):
+    # Status looks like "Up 5 minutes (healthy)" or "Up 2 seconds (health: starting)"
+    if not status or not status.endswith(")") or "(" not in status:
+        return ""
+    health = status[status.rindex("(") + 1 : -1]
+    health = health.removeprefix("health: ")
+    return health if health in ("healthy", "unhealthy", "starting") else ""
+
+
+def container_to_ps(container):
+    """Convert an Engine API container summary to the `docker compose ps --format=json` shape."""
+    labels = container.get("Labels") or {}
+    names = container.get("Names") or []
+    publishers = []
+    for port in container.get("Ports") or []:
+        publishers.append(
+            {
+                "URL": port.get("IP", ""),
+                "TargetPort": port.get("PrivatePort", 0),
+                "PublishedPort": port.get("PublicPort", 0),
+                "Protocol": port.get("Type", "tcp"),
+            }
+        )
+
+    return {
+        "ID": container.get("Id", ""),
+        "Name": names[0].lstrip("/") if names else "",
+        "Image": container.get("Image", ""),
+        "Command": container.get("Command", ""),
+        "Project": labels.get(PROJECT_LABEL, ""),
+        "Service": labels.get(SERVICE_LABEL, ""),
+        "State": container.get("State", ""),
+        "Status": container.get("Status", ""),
+        "Health": split_health(container.get("Status", "")),
+        "Publishers": publishers,
+    }
+
+
+def event_to_compose(event):
+    """Convert an Engine API event to the `docker compose events --json` shape."""
+    attributes = (event.get("Actor") or {}).get("Attributes") or {}
+    return {
+        "time": event.get("time"),
+        "type": event.get("Type", ""),
+        "action": event.get("Action", ""),
+        "id": (event.get("Actor") or {}).get("ID", ""),
+        "project": attributes.get(PROJECT_LABEL, ""),
+        "service": attributes.get(SERVICE_LABEL, ""),
+        "attributes": attributes,
+    }
+
+
+class DockerApiClient:
+    """Minimal HTTP/1.1 client for the Docker Engine API over a unix socket.
+
+    A single keep-alive connection is reused for all requests, requests are serialized on it.
+    Streaming endpoints should use their own client, since they hold the connection open.
+    """
+
+    api_version = "v1.41"
+
+    def __init__(self, socket_path=None, timeout=10):
+        self.socket_path = socket_path or socket_path_from_env() or DEFAULT_SOCKET
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    def __repr__(self):
+        return f"DockerApiClient(socket_path={self.socket_path})"
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        if not self.connected:
+            self._reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+
+    async def close(self):
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    def _build_path(self, path, params=None):
+        path = f"/{self.api_version}{path}"
+        if params:
+            query = "&".join(
+                f"{k}={quote(v if isinstance(v, str) else json.dumps(v), safe='')}"
+                for k, v in params.items()
+            )
+            path = f"{path}?{query}"
+        return path
+
+    async def _send(self, method, path, body=None):
+        headers = [
+            f"{method} {path} HTTP/1.1",
+            "Host: docker",
+            "User-Agent: dcui",
+            "Accept: application/json",
+        ]
+        if body is not None:
+            headers += ["Content-Type: application/json", f"Content-Length: {len(body)}"]
+        self._writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + (body or b""))
+        await self._writer.drain()
+
+    async def _read_head(self):
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionResetError("docker socket closed the connection")
+        parts = status_line.decode("latin-1").split(" ", 2)
+        status = int(parts[1])
+
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        return status, headers
+
+    async def _iter_body(self, headers):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size_line = await self._reader.readline()
+                size = int(size_line.split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    # trailers, terminated by an empty line
+                    while (await self._reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                chunk = await self._reader.readexactly(size)
+                await self._reader.readexactly(2)
+                yield chunk
+        elif "content-length" in headers:
+            length = int(headers["content-length"])
+            if length:
+                yield await self._reader.readexactly(length)
+        else:
+            # no framing, body runs until the connection closes
+            while chunk := await self._reader.read(65536):
+                yield chunk
+            await self.close()
+
+    async def _request(self, method, path, body):
+        await self.connect()
+        await self._send(method, path, body)
+        status, headers = await self._read_head()
+        data = b"".join([chunk async for chunk in self._iter_body(headers)])
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, data
+
+    async def request(self, method, path, params=None, body=None):
+        full_path = self._build_path(path, params)
+        payload = None if body is None else json.dumps(body).encode()
+
+        async with self._lock:
+            # a keep-alive connection may have been dropped by the daemon since the last request,
+            # so retry once on a fresh connection before giving up
+            for attempt in range(2):
+                try:
+                    status, data = await asyncio.wait_for(
+                        self._request(method, full_path, payload), self.timeout
+                    )
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    await self.close()
+                    if attempt:
+                        raise
+                except BaseException:
+                    await self.close()
+                    raise
+
+        if status >= 400:
+            raise DockerApiError(method, full_path, status, data)
+
+        return json.loads(data) if data else None
+
+    async def stream_json(self, method, path, params=None):
+        """Yield newline delimited json objects from a streaming endpoint, like /events.
+
+        Holds this client's connection for as long as the stream is consumed.
+        """
+        full_path = self._build_path(path, params)
+        try:
+            await self.connect()
+            await self._send(method, full_path)
+            status, headers = await self._read_head()
+            if status >= 400:
+                data = b"".join([chunk async for chunk in self._iter_body(headers)])
+                raise DockerApiError(method, full_path, status, data)
+
+            buffer = b""
+            async for chunk in self._iter_body(headers):
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if line.strip():
+                        yield json.loads(line)
+        finally:
+            await self.close()
+
+    async def events(self, project=None, labels=None, since=None):
+        params = {"filters": {"type": ["container"], **label_filters(project, labels=labels)}}
+        if since is not None:
+            params["since"] = str(int(since))
+        async for event in self.stream_json("GET", "/events", params=params):
+            yield event
+
+    async def containers(self, project=None, services=None, labels=None, all=False):
+        params = {"filters": label_filters(project, services, labels)}
+        if all:
+            params["all"] = "1"
+        return await self.request("GET", "/containers/json", params=params)
@@ -1,10 +1,21 @@
 import json
 import os
+import re
 import subprocess
 
+from dotenv import dotenv_values
 from yaml import load
 
-from .utils import stream_stdout_and_stderr, run_async
+from .docker_api import (
+    PROJECT_LABEL,
+    SERVICE_LABEL,
+    DockerApiClient,
+    container_to_ps,
+    split_health,
+    event_to_compose,
+    socket_path_from_env,
+)
+from .utils import stream_stdout_and_stderr, run_async, iter_async_lines
 
 try:
     from yaml import CLoader as Loader, CDumper as Dumper
@@ -12,10 +23,139 @@ except ImportError:
     from yaml import Loader, Dumper
 
 
+def normalize_project_name(name):
+    # same rules compose uses: lowercase, only [a-z0-9_-], starting with a letter or digit
+    return re.sub(r"^[^a-z0-9]+", "", re.sub(r"[^a-z0-9_-]", "", name.lower()))
+
+
+PORT_RE = re.compile(r"^(?:(?P<url>.*):(?P<published>\d+)->)?(?P<target>\d+)/(?P<protocol>\w+)$")
+
+
+def parse_ports(ports):
+    publishers = []
+    for port in ports.split(", ") if ports else []:
+        match = PORT_RE.match(port.strip())
+        if not match:
+            # port ranges and anything else we don't understand
+            continue
+        publishers.append(
+            {
+                "URL": (match["url"] or "").strip("[]"),
+                "TargetPort": int(match["target"]),
+                "PublishedPort": int(match["published"] or 0),
+                "Protocol": match["protocol"],
+            }
+        )
+    return publishers
+
+
+def docker_ps_to_compose(row):
+    """Convert a `docker ps --format={{json .}}` row to the `docker compose ps --format=json` shape."""
+    labels = dict(label.partition("=")[::2] for label in (row.get("Labels") or "").split(","))
+    return {
+        "ID": row.get("ID", ""),
+        "Name": row.get("Names", ""),
+        "Image": row.get("Image", ""),
+        "Command": row.get("Command", "").strip('"'),
+        "Project": labels.get(PROJECT_LABEL, ""),
+        "Service": labels.get(SERVICE_LABEL, ""),
+        "State": row.get("State", ""),
+        "Status": row.get("Status", ""),
+        "Health": split_health(row.get("Status", "")),
+        "Publishers": parse_ports(row.get("Ports", "")),
+    }
+
+
+def group_by_project(containers):
+    projects = {}
+    for container in containers:
+        projects.setdefault(container["Project"], []).append(container)
+    return projects
+
+
+class CliBackend:
+    async def ps_all(self):
+        command = [
+            "docker",
+            "ps",
+            "--filter",
+            f"label={PROJECT_LABEL}",
+            "--format={{json .}}",
+            "--no-trunc",
+        ]
+        lines = await run_async(command)
+        return group_by_project(
+            docker_ps_to_compose(json.loads(line)) for line in lines.splitlines()
+        )
+
+    async def events_all(self, since=None):
+        command = [
+            "docker",
+            "events",
+            "--filter",
+            "type=container",
+            "--filter",
+            f"label={PROJECT_LABEL}",
+            "--format={{json .}}",
+        ]
+        if since is not None:
+            command.append(f"--since={int(since)}")
+        async for line in iter_async_lines(command):
+            if line.strip():
+                yield event_to_compose(json.loads(line))
+
+
+class EngineBackend:
+    def __init__(self, client=None):
+        self.client = client or DockerApiClient()
+
+    def __repr__(self):
+        return f"EngineBackend(client={self.client})"
+
+    async def ps_all(self):
+        containers = await self.client.containers(labels=[PROJECT_LABEL])
+        return group_by_project(container_to_ps(c) for c in containers)
+
+    async def events_all(self, since=None):
+        # the event stream holds its connection open, so it gets its own client
+        client = DockerApiClient(self.client.socket_path, timeout=None)
+        async for event in client.events(labels=[PROJECT_LABEL], since=since):
+            yield event_to_compose(event)
+
+
+_default_backend = None
+
+
+def default_backend():
+    global _default_backend
+
+    if _default_backend is None:
+        socket_path = socket_path_from_env()
+        if socket_path and os.path.exists(socket_path):
+            _default_backend = EngineBackend(DockerApiClient(socket_path))
+        else:
+            _default_backend = CliBackend()
+
+    return _default_backend
+
+
 class DockerCompose:
     def __init__(self, docker_file):
         self.docker_file = docker_file
         self.prefix = ["docker", "compose", "-f", self.docker_file]
+        self._project_name = None
+
+    @property
+    def project_name(self):
+        if self._project_name is None:
+            dirname = os.path.dirname(os.path.abspath(self.docker_file))
+            env = dotenv_values(os.path.join(dirname, ".env"))
+            name = os.environ.get("COMPOSE_PROJECT_NAME") or env.get("COMPOSE_PROJECT_NAME")
+            if not name:
+                name = (self.load_docker_compose(self.docker_file) or {}).get("name")
+            self._project_name = normalize_project_name(name or os.path.basename(dirname))
+
+        return self._project_name
 
     def load_docker_compose(self, filename):
         with open(filename) as f:
@@ -68,20 +208,29 @@ class DockerCompose:
 
         return self.handle_command(command, return_command=return_command, callback=callback)
 
-    async def ps(self):
-        command = self.prefix + ["ps", "--format=json"]
-        lines = await run_async(command)
-        data = []
-        for line in lines.splitlines():
-            line_data = json.loads(line)
-            data.append(line_data)
-
-        return data
-
-    def logs(self, services=None, tail=True, callback=None, return_command=True):
+    def logs(
+        self,
+        services=None,
+        tail=True,
+        timestamps=False,
+        color=True,
+        lines=None,
+        until=None,
+        callback=None,
+        return_command=True,
+    ):
         command = self.prefix + ["logs"]
         if tail:
             command.append("-f")
+        if lines is not None:
+            # per container, not in total
+            command.extend(["--tail", str(lines)])
+        if until is not None:
+            command.extend(["--until", until])
+        if timestamps:
+            command.append("--timestamps")
+        if not color:
+            command.append("--no-color")
         if services:
             command.extend(services)
 
@@ -0,0 +1,414 @@
+import asyncio
+import contextlib
+import gzip
+import lzma
+import os
+import zlib
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+from .log_streams import LOG_PREFIX_RE, parse_timestamp
+
+# lines per compressed member, all of a member is decompressed to read any line in it
+EXPORT_MEMBER_LINES = 16384
+# lines copied out of the store between letting the event loop run, about a millisecond's worth
+EXPORT_STEP_LINES = 2048
+# a tee writes what came in at most this often, so a quiet log doesn't end up as tiny members
+EXPORT_BATCH_SECONDS = 2.0
+# a segment file is finished and the next one started once it gets this big
+EXPORT_SEGMENT_BYTES = 32 * 1024 * 1024
+# decompressed members kept around for drawing and searching an export read back
+MEMBER_CACHE_SIZE = 16
+
+INDEX_SUFFIX = ".index"
+
+# name: (file suffix, new compressor, decompress) for one member
+COMPRESSIONS = {
+    "gzip": (".gz", lambda: zlib.compressobj(6, zlib.DEFLATED, 31), gzip.decompress),
+    "lzma": (".xz", lambda: lzma.LZMACompressor(preset=3), lzma.decompress),
+}
+
+
+def segment_path(base, segment, compression):
+    return f"{base}.{segment:04d}.log{COMPRESSIONS[compression][0]}"
+
+
+def line_timestamp(line):
+    """parse_timestamp, also for lines still with compose's "web-1  | " in front."""
+    timestamp = parse_timestamp(line)
+    if timestamp is None:
+        match = LOG_PREFIX_RE.match(line)
+        if match:
+            timestamp = parse_timestamp(match.group(2))
+    return timestamp
+
+
+def first_timestamp(lines):
+    # a batch without one near the start most likely has none at all, e.g. a build
+    for line in lines[:64]:
+        timestamp = line_timestamp(line)
+        if timestamp is not None:
+            return timestamp
+    return -1
+
+
+def read_lines(store, start, end):
+    """Lines start to end of a store, as bytes without the newline, a chunk at a time where the
+    store has them."""
+    lines = []
+    chunks = getattr(store, "chunks", None)
+    if chunks is not None:
+        for first, data, offsets, i, j in chunks(start, end):
+            chunk = [data[offsets[n] : offsets[n + 1]] for n in range(i, j)]
+            # the segment still being appended to is a bytearray
+            lines += chunk if isinstance(data, bytes) else map(bytes, chunk)
+            start = first + j - i
+    # and a line at a time from a store without them
+    lines += [store.raw(n) for n in range(start, end)]
+    return lines
+
+
+class LogExportWriter:
+    """Lines written to rotating compressed segment files, with a sidecar index.
+
+    Every batch of lines is compressed as a member of its own. gzip and xz both read members one
+    after the other as one file, so a segment is an ordinary .gz or .xz. The index, base +
+    ".index", starts with the compression and then has a line per member: its segment, offset,
+    size, first line number, line count, widest line and first timestamp, so reading can start at
+    any member without decompressing the ones before it. With keep only the newest keep segments
+    are left on disk.
+
+    write() and close() block, they're for one thread at a time.
+    """
+
+    def __init__(self, base, compression="gzip", segment_bytes=EXPORT_SEGMENT_BYTES, keep=None):
+        self.base = base
+        self.compression = compression
+        self.new_compressor = COMPRESSIONS[compression][1]
+        self.segment_bytes = segment_bytes
+        self.keep = keep
+        self.segment = -1
+        self.file = None
+        # lines and compressed bytes written so far
+        self.lines = 0
+        self.bytes = 0
+        # the index and the current segment stay open between writes, close() closes them
+        self.index = open(base + INDEX_SUFFIX, "w")  # noqa: SIM115
+        self.index.write(f"{compression}\n")
+        self.index.flush()
+
+    def __repr__(self):
+        return (
+            f"LogExportWriter(base={self.base}, segment={self.segment}, lines={self.lines}, "
+            f"bytes={self.bytes})"
+        )
+
+    def write(self, lines):
+        """Write lines as one member."""
+        pieces = [
+            b"\n".join(lines[i : i + EXPORT_STEP_LINES]) + b"\n"
+            for i in range(0, len(lines), EXPORT_STEP_LINES)
+        ]
+        self.write_member(pieces, len(lines), max(map(len, lines)), first_timestamp(lines))
+
+    def write_member(self, pieces, count, width, timestamp):
+        """Write a member already joined into pieces that each end with a newline."""
+        compressor = self.new_compressor()
+        # a piece at a time, the GIL is let go while each is compressed, zlib.compress() would
+        # hold it for the whole member
+        member = b"".join([*map(compressor.compress, pieces), compressor.flush()])
+        if self.file is None or (
+            self.file.tell() and self.file.tell() + len(member) > self.segment_bytes
+        ):
+            self._rotate()
+        offset = self.file.tell()
+        self.file.write(member)
+        self.file.flush()
+        # after the member is in the file, so whoever follows the index can always read it
+        self.index.write(
+            f"{self.segment}\t{offset}\t{len(member)}\t{self.lines}\t{count}\t{width}\t"
+            f"{timestamp}\n"
+        )
+        self.index.flush()
+        self.lines += count
+        self.bytes += len(member)
+
+    def _rotate(self):
+        if self.file is not None:
+            self.file.close()
+        self.segment += 1
+        # closed by the next rotation or close()
+        self.file = open(  # noqa: SIM115
+            segment_path(self.base, self.segment, self.compression), "wb"
+        )
+        if self.keep and self.segment >= self.keep:
+            try:
+                os.unlink(segment_path(self.base, self.segment - self.keep, self.compression))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.index.close()
+
+
+class LogExport:
+    """A store's lines written to a LogExportWriter a batch at a time, the compressing and writing
+    in a thread so the event loop carries on meanwhile.
+
+    With follow it's a tee: it starts with the lines the store has, then writes the ones appended
+    to it whenever schedule_update() says there are some, like a view, until close(). Without, it
+    writes the lines the store had when it started and is done. Only a batch of lines is copied
+    out of the store at a time, never all of it, so whoever owns the store keeps it open until
+    the export is done.
+    """
+
+    def __init__(self, store, writer, follow=False, on_done=None):
+        self.store = store
+        self.writer = writer
+        self.follow = follow
+        self.on_done = on_done
+        self.position = store.start
+        self.end = None if follow else store.end
+        # lines the store dropped before they got written
+        self.skipped = 0
+        self.error = None
+        self.closed = False
+        self._writing = False
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        self._stopped = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    def __repr__(self):
+        return f"LogExport(writer={self.writer}, follow={self.follow}, position={self.position})"
+
+    @property
+    def done(self):
+        return self._task.done()
+
+    def schedule_update(self):
+        self._wakeup.set()
+
+    def close(self):
+        """Stop following, what the store has that isn't written yet still is."""
+        if self.closed:
+            return
+        self.closed = True
+        if self.end is None:
+            self.end = self.store.end
+        self._stopped.set()
+        self._wakeup.set()
+
+    def _collect(self, limit=EXPORT_MEMBER_LINES):
+        store = self.store
+        if self.position < store.start:
+            # only the lines the export was to write count, not the ones after its end
+            dropped = store.start if self.end is None else min(store.start, self.end)
+            self.skipped += max(0, dropped - self.position)
+            self.position = store.start
+        end = min(store.end if self.end is None else self.end, store.end)
+        end = min(end, self.position + limit)
+        if end <= self.position:
+            return []
+        lines = read_lines(store, self.position, end)
+        self.position = end
+        return lines
+
+    async def _run(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while (member := await self._batch()) is not None:
+                    await self._write(self.writer.write_member, *member)
+                if self.closed or not self.follow:
+                    break
+                # what comes in meanwhile goes in the same member, unless close() comes first
+                with contextlib.suppress(TimeoutError):
+                    await asyncio.wait_for(self._stopped.wait(), EXPORT_BATCH_SECONDS)
+        except OSError as e:
+            self.error = e
+        except asyncio.CancelledError:
+            # the app is exiting, the rest is written now unless a thread still writes
+            if not self._writing:
+                while lines := self._collect():
+                    self.writer.write(lines)
+            raise
+        finally:
+            self.closed = True
+            if not self._writing:
+                self.writer.close()
+            if self.on_done:
+                self.on_done(self)
+
+    async def _batch(self):
+        # a member's worth, copied out of the store and joined a step at a time so neither the
+        # event loop nor the thread holds the GIL for long
+        pieces = []
+        count = width = 0
+        timestamp = -1
+        while count < EXPORT_MEMBER_LINES:
+            lines = self._collect(min(EXPORT_STEP_LINES, EXPORT_MEMBER_LINES - count))
+            if not lines:
+                break
+            if not pieces:
+                timestamp = first_timestamp(lines)
+            pieces.append(b"\n".join(lines) + b"\n")
+            count += len(lines)
+            width = max(width, max(map(len, lines)))
+            await asyncio.sleep(0)
+        return (pieces, count, width, timestamp) if pieces else None
+
+    async def _write(self, write, *args):
+        # only cleared once the thread is done, it carries on if the task is cancelled meanwhile
+        self._writing = True
+        await asyncio.to_thread(write, *args)
+        self._writing = False
+
+
+class ExportLogStore:
+    """A LogExportWriter's files read back like a LogStore, from the path of the index.
+
+    Only the index is read up front. A member is decompressed when one of its lines is wanted,
+    the last few are kept. Members a tee adds are picked up by index() and those of segments it
+    removed are dropped from the front, so LogFileStream can follow it like any log file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.base = path[: -len(INDEX_SUFFIX)]
+        # followed as the tee writing it adds members, close() closes it
+        self.index_file = open(path, "rb")  # noqa: SIM115
+        self.compression = self.index_file.readline().decode().strip()
+        self.decompress = COMPRESSIONS[self.compression][2]
+        # per member, from the index
+        self.segments = array("q")
+        self.offsets = array("q")
+        self.sizes = array("q")
+        self.firsts = array("q")
+        self.timestamps = array("q")
+        # the first member there still is
+        self.first = 0
+        self.start = 0
+        self.end = 0
+        self.dropped = 0
+        self._width = 0
+        self._partial = b""
+        self._members = {}
+
+    def __repr__(self):
+        return f"ExportLogStore(path={self.path}, start={self.start}, end={self.end})"
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def content_width(self):
+        return self._width
+
+    @property
+    def done(self):
+        # index() always reads the whole of it
+        return True
+
+    def refresh(self):
+        """Whether the index has grown since it was read."""
+        return os.fstat(self.index_file.fileno()).st_size > self.index_file.tell()
+
+    def index(self, deadline):
+        """Read the members added to the index, returns whether there were any."""
+        data = self._partial + self.index_file.read()
+        *entries, self._partial = data.split(b"\n")
+        for entry in entries:
+            segment, offset, size, first, count, width, timestamp = map(int, entry.split(b"\t"))
+            self.segments.append(segment)
+            self.offsets.append(offset)
+            self.sizes.append(size)
+            self.firsts.append(first)
+            self.timestamps.append(timestamp)
+            self.end = first + count
+            self._width = max(self._width, width)
+        self._drop_removed()
+        return bool(entries)
+
+    def _drop_removed(self):
+        # segments a tee with keep removed, checked once per segment
+        while self.first < len(self.segments) and not os.path.exists(
+            segment_path(self.base, self.segments[self.first], self.compression)
+        ):
+            segment = self.segments[self.first]
+            while self.first < len(self.segments) and self.segments[self.first] == segment:
+                self.first += 1
+            self.start = self.dropped = (
+                self.firsts[self.first] if self.first < len(self.segments) else self.end
+            )
+
+    def _member(self, k):
+        """The lines of member k as one buffer without their newlines and the offset of each, one
+        more for the end."""
+        member = self._members.get(k)
+        if member is not None:
+            return member
+        with open(segment_path(self.base, self.segments[k], self.compression), "rb") as f:
+            f.seek(self.offsets[k])
+            lines = self.decompress(f.read(self.sizes[k]))[:-1].split(b"\n")
+        member = b"".join(lines), array("Q", accumulate(map(len, lines), initial=0))
+        if len(self._members) >= MEMBER_CACHE_SIZE:
+            del self._members[next(iter(self._members))]
+        self._members[k] = member
+        return member
+
+    def _locate(self, index):
+        if index < self.start or index >= self.end:
+            raise IndexError(index)
+        k = bisect_right(self.firsts, index, self.first) - 1
+        return k, index - self.firsts[k]
+
+    def raw(self, index):
+        k, i = self._locate(index)
+        data, offsets = self._member(k)
+        return data[offsets[i] : offsets[i + 1]]
+
+    def __getitem__(self, index):
+        return self.raw(index).decode(errors="replace")
+
+    def get(self, index, default=""):
+        try:
+            return self[index]
+        except IndexError:
+            return default
+
+    def chunks(self, start, end):
+        """Like LogStore.chunks, a member at a time."""
+        start = max(start, self.start)
+        end = min(end, self.end)
+        while start < end:
+            k, i = self._locate(start)
+            data, offsets = self._member(k)
+            j = min(len(offsets) - 1, i + end - start)
+            yield start, data, offsets, i, j
+            start += j - i
+
+    def line_at(self, timestamp):
+        """The first line logged at or after timestamp, in nanoseconds like parse_timestamp, or
+        None. Only the member the index says it's in and the ones after are looked through."""
+        if self.first >= len(self.firsts):
+            return None
+        # members go in time order, apart from ones without a timestamp at all, which are -1
+        k = max(bisect_right(self.timestamps, timestamp, self.first) - 1, self.first)
+        while k > self.first and not 0 <= self.timestamps[k] <= timestamp:
+            k -= 1
+        for first, data, offsets, i, j in self.chunks(self.firsts[k], self.end):
+            for n in range(i, j):
+                line_time = line_timestamp(data[offsets[n] : offsets[n + 1]])
+                if line_time is not None and line_time >= timestamp:
+                    return first + n - i
+        return None
+
+    def close(self):
+        self.index_file.close()
+        self._members = {}
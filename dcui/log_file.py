@@ -0,0 +1,281 @@
+import asyncio
+import json
+import mmap
+import os
+import time
+from array import array
+
+from .log_export import INDEX_SUFFIX, ExportLogStore
+
+# lines per entry of the sparse line index, the lines in between are found when needed
+INDEX_EVERY = 256
+
+# how much of the file one go of the indexer looks at, and how long it may hold the event loop
+INDEX_CHUNK_BYTES = 1024 * 1024
+INDEX_STEP_SECONDS = 0.005
+
+# how often a followed file is checked for new data
+FOLLOW_INTERVAL = 0.5
+
+# the blocks of line offsets kept around for drawing and searching
+BLOCK_CACHE_SIZE = 64
+
+# how much of a last line without a newline yet is read, a file that never has one shows in part
+PARTIAL_LINE_BYTES = 64 * 1024
+
+
+class MappedLogStore:
+    """A log file read through mmap, read like a LogStore.
+
+    Nothing is copied up front: an indexer goes through the file a chunk at a time and keeps the
+    offset of every INDEX_EVERY'th line, so the index stays small however big the file is, and
+    the lines in between are found in the mapped file when they are shown. A last line without
+    a newline yet is there too once everything before it is indexed, it grows as the file does.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.map = None
+        self.size = 0
+        self.sparse = array("Q")
+        # complete lines indexed, and the offset just after the last of them
+        self.lines = 0
+        self.indexed = 0
+        # the offset just after the last newline in the file, as far as the indexer goes
+        self.complete = 0
+        self.start = 0
+        self.dropped = 0
+        self._width = 0
+        self._blocks = {}
+        self.refresh()
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(path={self.path}, end={self.end}, "
+            f"indexed={self.indexed}/{self.size})"
+        )
+
+    @property
+    def end(self):
+        return self.lines + (1 if self.done and self.indexed < self.size else 0)
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def content_width(self):
+        if not self.done:
+            return self._width
+        return max(self._width, min(self.size - self.indexed, PARTIAL_LINE_BYTES))
+
+    @property
+    def done(self):
+        return self.indexed >= self.complete
+
+    def refresh(self):
+        """Pick up what was appended to the file, returns whether there was anything.
+
+        A file that got shorter was truncated or replaced, it's indexed again from the start.
+        """
+        size = os.fstat(self.fd).st_size
+        if size == self.size:
+            return False
+        if size < self.size:
+            self.sparse = array("Q")
+            self.lines = self.indexed = self.complete = self._width = 0
+            self._blocks = {}
+        old = self.map
+        # a map can't grow, a new one of the whole file replaces it
+        self.map = mmap.mmap(self.fd, size, access=mmap.ACCESS_READ) if size else None
+        self.size = size
+        if old is not None:
+            old.close()
+        if self.map is not None:
+            # only what was appended is looked through, a huge last line isn't again and again
+            last = self.map.rfind(b"\n", self.complete)
+            if last != -1:
+                self.complete = last + 1
+        return True
+
+    def index(self, deadline):
+        """Index complete lines until there are none left or time.monotonic() passes deadline,
+        returns whether any were added."""
+        added = False
+        while self.indexed < self.complete:
+            start = self.indexed
+            # read rather than through the map, so the file doesn't stay resident once indexed
+            data = os.pread(self.fd, min(INDEX_CHUNK_BYTES, self.complete - start), start)
+            end = data.rfind(b"\n")
+            if end != -1:
+                data = data[:end]
+            else:
+                # a line longer than a chunk
+                end = self.map.find(b"\n", start) - start
+                data = self.map[start : start + end]
+            end += start
+            lengths = list(map(len, data.split(b"\n")))
+            # offsets of the lines that are a multiple of INDEX_EVERY
+            skip = -self.lines % INDEX_EVERY
+            offset = start + sum(lengths[:skip]) + skip
+            for i in range(skip, len(lengths), INDEX_EVERY):
+                self.sparse.append(offset)
+                offset += sum(lengths[i : i + INDEX_EVERY]) + INDEX_EVERY
+            self.lines += len(lengths)
+            self._width = max(self._width, max(lengths))
+            self.indexed = end + 1
+            added = True
+            if time.monotonic() >= deadline:
+                break
+        return added
+
+    def _block(self, block):
+        """Offsets of the lines of a block, one more than there are lines for where the last
+        one ends."""
+        offsets = self._blocks.get(block)
+        if offsets is not None:
+            return offsets
+        offsets = array("Q", [self.sparse[block]])
+        count = min(INDEX_EVERY, self.lines - block * INDEX_EVERY)
+        find = self.map.find
+        for _ in range(count):
+            offsets.append(find(b"\n", offsets[-1]) + 1)
+        if count == INDEX_EVERY:
+            # the last block still gets lines, only complete ones are kept
+            if len(self._blocks) >= BLOCK_CACHE_SIZE:
+                del self._blocks[next(iter(self._blocks))]
+            self._blocks[block] = offsets
+        return offsets
+
+    def raw(self, index):
+        if index < self.start or index >= self.end:
+            raise IndexError(index)
+        if index == self.lines:
+            return self.map[self.indexed : min(self.size, self.indexed + PARTIAL_LINE_BYTES)]
+        block, i = divmod(index, INDEX_EVERY)
+        offsets = self._block(block)
+        return self.map[offsets[i] : offsets[i + 1] - 1]
+
+    def __getitem__(self, index):
+        return self.raw(index).decode(errors="replace")
+
+    def get(self, index, default=""):
+        try:
+            return self[index]
+        except IndexError:
+            return default
+
+    def chunks(self, start, end):
+        """Like LogStore.chunks, a block of lines at a time, without their newlines. A last line
+        without a newline yet comes as a chunk of its own."""
+        start = max(start, self.start)
+        end = min(end, self.end)
+        while start < end:
+            if start == self.lines:
+                line = self.raw(start)
+                yield start, line, array("Q", [0, len(line)]), 0, 1
+                return
+            block, i = divmod(start, INDEX_EVERY)
+            offsets = self._block(block)
+            j = min(len(offsets) - 1, i + end - start)
+            base = offsets[0]
+            data = self.map[base : offsets[-1]].replace(b"\n", b"")
+            # every line before the nth ended with a newline that's left out
+            lines = array("Q", (offset - base - n for n, offset in enumerate(offsets)))
+            yield start, data, lines, i, j
+            start += j - i
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class JsonFileLogStore(MappedLogStore):
+    """A container log from docker's json-file driver, shown as "<time> <line>"."""
+
+    # searching goes through raw() so it sees what's shown rather than the json
+    chunks = None
+
+    def raw(self, index):
+        line = super().raw(index)
+        try:
+            entry = json.loads(line)
+            return f"{entry['time']} {entry['log'].rstrip()}".encode()
+        except (ValueError, KeyError, TypeError):
+            return line
+
+
+def open_log_file(path):
+    """The store for a log file, json-file container logs are decoded and an export is read
+    through its index."""
+    if path.endswith(INDEX_SUFFIX):
+        return ExportLogStore(path)
+    with open(path, "rb") as f:
+        head = f.read(16)
+    if head.startswith(b'{"log":'):
+        return JsonFileLogStore(path)
+    return MappedLogStore(path)
+
+
+class LogFileStream:
+    """A log file for StreamLogs, indexed in the background and followed as it grows."""
+
+    def __init__(self, path, follow=True):
+        self.path = path
+        self.follow = follow
+        self.store = open_log_file(path)
+        self.views = []
+        self.closed = False
+        self.on_close = None
+        self._task = None
+
+    def __repr__(self):
+        return f"LogFileStream(store={self.store}, views={len(self.views)})"
+
+    def subscribe(self, view):
+        self.views.append(view)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        view.schedule_update()
+
+    def unsubscribe(self, view):
+        if view in self.views:
+            self.views.remove(view)
+        if not self.views:
+            self.close()
+
+    def backfill(self):
+        # the whole file is there already
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+        self.store.close()
+        if self.on_close:
+            self.on_close(self)
+
+    def _notify(self):
+        for view in self.views:
+            view.schedule_update()
+
+    async def _run(self):
+        while True:
+            if self.store.index(time.monotonic() + INDEX_STEP_SECONDS):
+                self._notify()
+            if not self.store.done:
+                await asyncio.sleep(0)
+                continue
+            if not self.follow:
+                return
+            await asyncio.sleep(FOLLOW_INTERVAL)
+            if self.store.refresh():
+                # a growing last line shows without anything new to index
+                self._notify()
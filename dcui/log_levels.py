@@ -0,0 +1,79 @@
+import re
+import time
+from array import array
+
+# upper case level names anywhere, lower case ones only where a logger puts them, so "no error"
+# in a message doesn't count
+LEVEL_RE = re.compile(
+    rb"\b(?:(?P<error>ERROR|FATAL|CRITICAL|PANIC)|(?P<warning>WARN(?:ING)?))\b"
+    rb'|(?:level=|"level":\s*"|\[)'
+    rb"(?:(?P<error_lower>error|fatal|critical|panic)|(?P<warning_lower>warn(?:ing)?))\b"
+)
+
+# the level is near the start of a line, long lines aren't searched to the end
+LEVEL_SEARCH_BYTES = 256
+
+# seconds of counts kept per service
+RATE_WINDOW = 60
+
+
+def classify(line):
+    """The level of a line, "error", "warning" or None."""
+    match = LEVEL_RE.search(line, 0, LEVEL_SEARCH_BYTES)
+    if match is None:
+        return None
+    return "error" if match.lastgroup.startswith("error") else "warning"
+
+
+class LevelCounters:
+    """Lines, errors and warnings of one service over the last RATE_WINDOW seconds.
+
+    Each is a ring of per second counts, by the time the line was logged rather than when it
+    arrived, so the history a log stream starts with doesn't look like a burst.
+    """
+
+    __slots__ = ("_last_second", "errors", "lines", "newest", "warnings")
+
+    def __init__(self):
+        self.lines = array("I", bytes(4 * RATE_WINDOW))
+        self.errors = array("I", bytes(4 * RATE_WINDOW))
+        self.warnings = array("I", bytes(4 * RATE_WINDOW))
+        # the latest second counted so far
+        self.newest = 0
+        self._last_second = None
+
+    def __repr__(self):
+        now = int(time.time())
+        return (
+            f"LevelCounters(lines={self.count(self.lines, now)}, "
+            f"errors={self.count(self.errors, now)}, warnings={self.count(self.warnings, now)})"
+        )
+
+    def add(self, line, second=None):
+        """Count a line logged at second, since the epoch."""
+        if second is None:
+            # e.g. the rest of a traceback, logged with the line before it
+            second = self._last_second or int(time.time())
+        self._last_second = second
+
+        if second > self.newest:
+            # the seconds in between had nothing
+            for s in range(max(self.newest + 1, second - RATE_WINDOW + 1), second + 1):
+                i = s % RATE_WINDOW
+                self.lines[i] = self.errors[i] = self.warnings[i] = 0
+            self.newest = second
+        elif second <= self.newest - RATE_WINDOW:
+            return
+
+        i = second % RATE_WINDOW
+        self.lines[i] += 1
+        level = classify(line)
+        if level == "error":
+            self.errors[i] += 1
+        elif level == "warning":
+            self.warnings[i] += 1
+
+    def count(self, ring, now, seconds=RATE_WINDOW):
+        """How many in the `seconds` up to now, from one of the rings."""
+        first = max(now - seconds + 1, self.newest - RATE_WINDOW + 1)
+        return sum(ring[s % RATE_WINDOW] for s in range(first, min(now, self.newest) + 1))
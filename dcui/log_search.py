@@ -0,0 +1,198 @@
+import re
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+# how long one step of a search may hold the event loop
+SEARCH_STEP_SECONDS = 0.005
+
+# anything that makes a match depend on where the line ends, or starts
+ANCHORS_RE = re.compile(r"[\^$]|\\[bBAZ]|\(\?<?[=!]")
+
+
+def compile_search(text):
+    """The bytes pattern for searching a log store, raises re.error for a bad one."""
+    return re.compile(text.encode())
+
+
+class LogSearch:
+    """The lines of a LogStore that match a pattern, found a bit at a time.
+
+    Matching line numbers are kept in order in one array, so finding the next or previous match
+    from anywhere is a bisect. `scan()` goes through lines that haven't been looked at yet until a
+    deadline: new ones at the end first, then ones prepended at the front. Matches are numbered
+    like a store's lines, from `start` to `end`, which is what FilteredLogStore shows.
+    """
+
+    def __init__(self, store, pattern):
+        self.store = store
+        self.pattern = pattern
+        # without anchors a match inside a line is also one in the segment's buffer, so a whole
+        # segment can be searched in one go and only the lines a match lands on looked at
+        self.whole_buffer = not ANCHORS_RE.search(
+            pattern.pattern.decode(errors="replace")
+        ) and not pattern.match(b"")
+        self.matches = array("q")
+        # match number of matches[0]
+        self.base = 0
+        # lines from scanned_start to scanned_end have been searched
+        self.scanned_start = store.start
+        self.scanned_end = store.start
+
+    def __repr__(self):
+        return (
+            f"LogSearch(pattern={self.pattern.pattern}, matches={len(self)}, "
+            f"scanned={self.scanned_end - self.scanned_start}/{len(self.store)})"
+        )
+
+    @property
+    def first(self):
+        # matches on lines the store has dropped are only trimmed once in a while
+        return bisect_left(self.matches, self.store.start)
+
+    @property
+    def start(self):
+        return self.base + self.first
+
+    @property
+    def end(self):
+        return self.base + len(self.matches)
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def done(self):
+        return self.scanned_start <= self.store.start and self.scanned_end >= self.store.end
+
+    @property
+    def progress(self):
+        total = len(self.store)
+        scanned = self.scanned_end - max(self.scanned_start, self.store.start)
+        return min(1.0, scanned / total) if total else 1.0
+
+    def line(self, number):
+        """The line in the store of match `number`."""
+        if number < self.start or number >= self.end:
+            raise IndexError(number)
+        return self.matches[number - self.base]
+
+    def next(self, line):
+        """The match number of the first match after line, or None."""
+        i = max(bisect_right(self.matches, line), self.first)
+        return self.base + i if i < len(self.matches) else None
+
+    def previous(self, line):
+        """The match number of the last match before line, or None."""
+        i = bisect_left(self.matches, line) - 1
+        return self.base + i if i >= self.first else None
+
+    def number(self, line):
+        """The match number of the first match at or after line, for keeping a place."""
+        return self.base + max(bisect_left(self.matches, line), self.first)
+
+    def scan(self, deadline):
+        """Search lines until there are none left or time.monotonic() passes deadline, returns
+        how many matches were found."""
+        found = 0
+        store = self.store
+        self.scanned_end = max(self.scanned_end, store.start)
+        if self.scanned_end < store.end:
+            matches = array("q")
+            self.scanned_end = self._scan(self.scanned_end, store.end, matches, deadline)
+            self.matches.extend(matches)
+            found += len(matches)
+
+        self.scanned_start = max(min(self.scanned_start, self.scanned_end), store.start)
+        if store.start < self.scanned_start and time.monotonic() < deadline:
+            # lines put in front of the ones already searched, kept in order before them
+            matches = array("q")
+            end = self.scanned_start
+            start = max(store.start, end - 4096)
+            if self._scan(start, end, matches, deadline) == end:
+                self.matches[:0] = matches
+                self.base -= len(matches)
+                self.scanned_start = start
+                found += len(matches)
+
+        first = self.first
+        if first > 65536:
+            del self.matches[:first]
+            self.base += first
+        return found
+
+    def _scan(self, start, end, matches, deadline):
+        # returns where it got to, always the end of a segment
+        search = self.pattern.search
+        if getattr(self.store, "chunks", None) is None:
+            # e.g. a merged store, whose lines are spread over others
+            for n in range(start, end):
+                if search(self.store.raw(n)):
+                    matches.append(n)
+                if n % 1024 == 1023 and time.monotonic() >= deadline:
+                    return n + 1
+            return end
+
+        for first, data, offsets, i, j in self.store.chunks(start, end):
+            if self.whole_buffer:
+                pos = offsets[i]
+                stop = offsets[j]
+                while (match := search(data, pos, stop)) is not None:
+                    n = bisect_right(offsets, match.start(), i, j) - 1
+                    line_end = offsets[n + 1]
+                    # the match may run on into the next line, there may be one inside this one
+                    if match.end() <= line_end or search(data, offsets[n], line_end):
+                        matches.append(first + n - i)
+                    pos = line_end
+                    if pos >= stop:
+                        break
+            else:
+                for n in range(i, j):
+                    # a slice so that ^ matches at the start of the line
+                    if search(data[offsets[n] : offsets[n + 1]]):
+                        matches.append(first + n - i)
+            start = first + j - i
+            if time.monotonic() >= deadline:
+                break
+        return start
+
+
+class FilteredLogStore:
+    """Just the matching lines of a LogSearch, read like a LogStore."""
+
+    def __init__(self, search):
+        self.search = search
+
+    def __repr__(self):
+        return f"FilteredLogStore({self.search})"
+
+    @property
+    def start(self):
+        return self.search.start
+
+    @property
+    def end(self):
+        return self.search.end
+
+    def __len__(self):
+        return len(self.search)
+
+    @property
+    def content_width(self):
+        return self.search.store.content_width
+
+    def raw(self, index):
+        return self.search.store.raw(self.search.line(index))
+
+    def __getitem__(self, index):
+        return self.raw(index).decode(errors="replace")
+
+    def get(self, index, default=""):
+        try:
+            return self[index]
+        except IndexError:
+            return default
+
+    def close(self):
+        # the store is the search's
+        pass
@@ -0,0 +1,259 @@
+import os
+import tempfile
+from array import array
+from bisect import bisect_right
+
+SEGMENT_LINES = 4096
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class _Segment:
+    # all the segment's lines in one buffer, offsets[i]:offsets[i + 1] is line i
+    __slots__ = ("data", "offsets", "width")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array("Q", [0])
+        self.width = 0
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+    def append(self, line):
+        self.data += line
+        self.offsets.append(len(self.data))
+        self.width = max(self.width, len(line))
+
+    def raw(self, i, store):
+        return bytes(self.data[self.offsets[i] : self.offsets[i + 1]])
+
+    def buffer(self, store):
+        return self.data, self.offsets
+
+
+class _DiskSegment:
+    __slots__ = ("offsets", "width")
+
+    def __init__(self, offsets, width):
+        # offsets[i]:offsets[i + 1] is line i in the spill file
+        self.offsets = offsets
+        self.width = width
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def raw(self, i, store):
+        start = self.offsets[i]
+        return os.pread(store.spill_file.fileno(), self.offsets[i + 1] - start, start)
+
+    def buffer(self, store):
+        start = self.offsets[0]
+        data = os.pread(store.spill_file.fileno(), self.offsets[-1] - start, start)
+        return data, array("Q", (offset - start for offset in self.offsets))
+
+
+class LogStore:
+    """Bounded line storage for log panes, addressed by absolute line number.
+
+    Lines are kept as utf-8 bytes in fixed size segments, each one a single buffer plus an array of
+    line offsets, and only decoded when asked for. Once more than max_lines / max_bytes are held in
+    memory the oldest segment is dropped, or written to an append-only spill file if spill is set,
+    in which case its lines stay readable. `start` and `end` are absolute line numbers, so views
+    can tell how many lines were appended, prepended or dropped since they last looked.
+    """
+
+    def __init__(self, max_lines=None, max_bytes=DEFAULT_MAX_BYTES, spill=False, spill_dir=None):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.spill = spill
+        self.spill_dir = spill_dir
+        self.spill_file = None
+        self.segment_lines = SEGMENT_LINES
+        if max_lines:
+            # keep eviction reasonably fine grained for small buffers
+            self.segment_lines = max(16, min(SEGMENT_LINES, max_lines // 8))
+
+        self.segments = []
+        # absolute line number of the first line of each segment
+        self.segment_starts = []
+        self.start = 0
+        self.end = 0
+        # lines dropped from the front for good, spilled ones are still there
+        self.dropped = 0
+        self.mem_lines = 0
+        self.mem_bytes = 0
+        self._width = None
+
+    def __repr__(self):
+        return (
+            f"LogStore(start={self.start}, end={self.end}, mem_lines={self.mem_lines}, "
+            f"mem_bytes={self.mem_bytes})"
+        )
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def content_width(self):
+        # measured in bytes, which is exact for ascii and an upper bound otherwise
+        if self._width is None:
+            self._width = max([s.width for s in self.segments], default=0)
+        return self._width
+
+    def append(self, line):
+        if isinstance(line, str):
+            line = line.encode()
+
+        if (
+            not self.segments
+            or isinstance(self.segments[-1], _DiskSegment)
+            or len(self.segments[-1]) >= self.segment_lines
+        ):
+            if self.segments and isinstance(self.segments[-1], _Segment):
+                # full segments don't grow anymore, drop the bytearray's spare capacity
+                self.segments[-1].data = bytes(self.segments[-1].data)
+            self.segments.append(_Segment())
+            self.segment_starts.append(self.end)
+
+        segment = self.segments[-1]
+        segment.append(line)
+        self.end += 1
+        self.mem_lines += 1
+        self.mem_bytes += len(line)
+        if self._width is not None:
+            self._width = max(self._width, len(line))
+
+        if self._over_limit():
+            self._evict()
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+    def prepend(self, lines):
+        """Add older lines before the first one, returns how many were taken.
+
+        Nothing goes in front of lines that were dropped, and without spill only as many of the
+        newest ones as fit in memory are taken, so the lines that were prepended aren't the first
+        to be dropped again.
+        """
+        if self.dropped:
+            return 0
+        lines = [line.encode() if isinstance(line, str) else line for line in lines]
+        if not self.spill:
+            lines_left = self.max_lines - self.mem_lines if self.max_lines else len(lines)
+            bytes_left = self.max_bytes - self.mem_bytes if self.max_bytes else None
+            taken = 0
+            for line in reversed(lines):
+                if taken >= lines_left or (bytes_left is not None and len(line) > bytes_left):
+                    break
+                if bytes_left is not None:
+                    bytes_left -= len(line)
+                taken += 1
+            lines = lines[len(lines) - taken :]
+        if not lines:
+            return 0
+
+        # whole segments in front of the existing ones, the newest of them possibly short
+        start = self.start - len(lines)
+        segments = []
+        starts = []
+        for offset in range(0, len(lines), self.segment_lines):
+            segment = _Segment()
+            for line in lines[offset : offset + self.segment_lines]:
+                segment.append(line)
+            segment.data = bytes(segment.data)
+            segments.append(segment)
+            starts.append(start + offset)
+            self.mem_bytes += segment.nbytes
+            if self._width is not None:
+                self._width = max(self._width, segment.width)
+        self.segments[:0] = segments
+        self.segment_starts[:0] = starts
+        self.start = start
+        self.mem_lines += len(lines)
+
+        if self._over_limit():
+            self._evict()
+        return len(lines)
+
+    def _over_limit(self):
+        return (self.max_lines and self.mem_lines > self.max_lines) or (
+            self.max_bytes and self.mem_bytes > self.max_bytes
+        )
+
+    def _evict(self):
+        while self._over_limit():
+            index = next((i for i, s in enumerate(self.segments) if isinstance(s, _Segment)), None)
+            # never drop the segment being appended to
+            if index is None or index == len(self.segments) - 1:
+                return
+
+            segment = self.segments[index]
+            self.mem_lines -= len(segment)
+            self.mem_bytes -= segment.nbytes
+            if self.spill:
+                self.segments[index] = self._spill(segment)
+            else:
+                self.segments.pop(index)
+                self.segment_starts.pop(index)
+                self.start += len(segment)
+                self.dropped += len(segment)
+                self._width = None
+
+    def _spill(self, segment):
+        if self.spill_file is None:
+            # read back for as long as the store lives, close() closes it
+            self.spill_file = tempfile.TemporaryFile(  # noqa: SIM115
+                prefix="dcui-logs-", dir=self.spill_dir
+            )
+
+        base = self.spill_file.seek(0, os.SEEK_END)
+        self.spill_file.write(segment.data)
+        self.spill_file.flush()
+        offsets = array("Q", (base + offset for offset in segment.offsets))
+        return _DiskSegment(offsets, segment.width)
+
+    def _locate(self, index):
+        if index < self.start or index >= self.end:
+            raise IndexError(index)
+
+        i = bisect_right(self.segment_starts, index) - 1
+        return self.segments[i], index - self.segment_starts[i]
+
+    def raw(self, index):
+        segment, i = self._locate(index)
+        return segment.raw(i, self)
+
+    def chunks(self, start, end):
+        """The lines from start to end a segment at a time, as (first line, buffer, offsets, i, j)
+        where line first + n is buffer[offsets[i + n] : offsets[i + n + 1]] and i + n < j.
+
+        For going through many lines without a call per line, e.g. searching.
+        """
+        start = max(start, self.start)
+        end = min(end, self.end)
+        while start < end:
+            segment, i = self._locate(start)
+            data, offsets = segment.buffer(self)
+            j = min(len(segment), i + end - start)
+            yield start, data, offsets, i, j
+            start += j - i
+
+    def __getitem__(self, index):
+        return self.raw(index).decode(errors="replace")
+
+    def get(self, index, default=""):
+        try:
+            return self[index]
+        except IndexError:
+            return default
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
@@ -0,0 +1,695 @@
+import asyncio
+import heapq
+import re
+import time
+from array import array
+from bisect import bisect_left
+from datetime import UTC, datetime
+from functools import lru_cache
+
+from .log_levels import LevelCounters
+from .log_store import LogStore
+from .utils import stream_process
+
+
+class LogStream:
+    """One upstream command whose output goes into a LogStore, shown by any number of views.
+
+    The command is started when the first view subscribes and killed, and the store closed, when
+    the last one unsubscribes. Views get `schedule_update()` whenever lines were added.
+    """
+
+    def __init__(self, command, store: LogStore | None = None, exit_message=True, on_close=None):
+        self.command = command
+        self.store = store if store is not None else LogStore()
+        self.exit_message = exit_message
+        self.on_close = on_close
+        self.process = None
+        self.views = []
+        self.exit_callbacks = []
+        self.closed = False
+        self._task = None
+
+    def __repr__(self):
+        return f"LogStream(command={self.command}, views={len(self.views)}, store={self.store})"
+
+    def subscribe(self, view):
+        self.views.append(view)
+        self._start()
+        # a view joining late starts out with everything already in the store
+        view.schedule_update()
+
+    def unsubscribe(self, view):
+        if view in self.views:
+            self.views.remove(view)
+        if not self.in_use():
+            self.close()
+
+    def in_use(self):
+        return bool(self.views)
+
+    def backfill(self):
+        """Fetch lines from before the first one in the store, a plain command has none."""
+
+    def _start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.process and self.process.returncode is None:
+            print("terminate", self.process.pid, self.process)
+            try:
+                self.process.kill_group()
+            except OSError as e:
+                print("Failed to kill", self.process, e)
+        if self._task is not None:
+            self._task.cancel()
+        self.store.close()
+        if self.on_close:
+            self.on_close(self)
+
+    def add_line(self, line):
+        self.store.append(line)
+        self._notify()
+
+    def _notify(self):
+        for view in self.views:
+            view.schedule_update()
+
+    async def _read(self, line_batches):
+        async for lines in line_batches:
+            self.store.extend(lines)
+            self._notify()
+
+    async def _run(self):
+        self.add_line(f"running {self.command}")
+        try:
+            self.process = await stream_process(self.command)
+        except OSError as e:
+            self.add_line(f"failed to run {self.command}: {e}")
+            return
+        readers = [
+            asyncio.create_task(self._read(self.process.stdout_lines())),
+            asyncio.create_task(self._read(self.process.stderr_lines())),
+        ]
+
+        try:
+            return_code = await self.process.wait()
+            # anything the process left in the pipes, unless something it started still holds them
+            await asyncio.wait(readers, timeout=1)
+        finally:
+            for task in readers:
+                task.cancel()
+
+        for callback in self.exit_callbacks:
+            callback()
+
+        self.add_line(f"process ended return_code={return_code}")
+        if self.exit_message:
+            self.add_line("Press escape to close")
+
+
+# `docker compose logs --no-color` starts every line with the container, e.g. "web-1  | "
+LOG_PREFIX_RE = re.compile(rb"^([^\s|]+)\s*\| ?(.*)$", re.DOTALL)
+REPLICA_RE = re.compile(r"[-_]\d+$")
+
+# lines of history each container's logs start with, and how many more scrolling up fetches
+DEFAULT_LOG_TAIL = 1000
+
+
+class ServiceLogStream:
+    """The lines of one service, split out of a ProjectLogStream."""
+
+    def __init__(self, parent, service, store: LogStore):
+        self.parent = parent
+        self.service = service
+        self.store = store
+        self.views = []
+        # container -> timestamp of its first line in the store
+        self.oldest = {}
+        self.levels = LevelCounters()
+
+    def __repr__(self):
+        return f"ServiceLogStream(service={self.service}, views={len(self.views)})"
+
+    def subscribe(self, view):
+        self.views.append(view)
+        self.parent._start()
+        view.schedule_update()
+
+    def unsubscribe(self, view):
+        if view in self.views:
+            self.views.remove(view)
+        if not self.parent.in_use():
+            self.parent.close()
+
+    def backfill(self):
+        self.parent._backfill(self)
+
+    def _notify(self):
+        for view in self.views:
+            view.schedule_update()
+
+
+class _InterleavedLogStore:
+    """Lines of several stores in one order, read like a LogStore.
+
+    The order is kept as two arrays, which source and which line of its store, so only the lines
+    on screen are ever fetched, with the source's prefix in front. Each store's lines go in in
+    their own order and where each one went is kept, so when a store drops lines the front moves
+    past the last of them: the view covers the stretch all its stores still have, without gaps.
+    """
+
+    def __init__(self):
+        self.stores = []
+        # per source, its store's index in stores and its prefix, several sources can share a store
+        self.source_stores = []
+        self.prefixes = []
+        self.source_ids = array("H")
+        self.source_lines = array("q")
+        # absolute line number of the first entry of the arrays, and of the first one shown
+        self.base = 0
+        self.start = 0
+        # per store, the first of its lines that has an entry, and where each from there went
+        self._firsts = []
+        self._positions = []
+
+    @property
+    def end(self):
+        return self.base + len(self.source_ids)
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def content_width(self):
+        widths = [store.content_width for store in self.stores]
+        return max(widths, default=0) + max((len(p) for p in self.prefixes), default=0)
+
+    def _add_source(self, store, prefix):
+        for k, known in enumerate(self.stores):
+            if known is store:
+                break
+        else:
+            k = len(self.stores)
+            self.stores.append(store)
+            self._firsts.append(None)
+            self._positions.append(array("q"))
+        self.source_stores.append(k)
+        self.prefixes.append(prefix)
+        return len(self.prefixes) - 1
+
+    def add(self, i, index):
+        """Put line index of source i's store at the end, the lines of a store go in in order."""
+        k = self.source_stores[i]
+        positions = self._positions[k]
+        if self._firsts[k] is None or index != self._firsts[k] + len(positions):
+            # the store dropped the lines before this one without them getting in, and so every
+            # line of it already in
+            if positions:
+                self.start = max(self.start, positions[-1] + 1)
+                del positions[:]
+            self._firsts[k] = index
+        positions.append(self.end)
+        self.source_ids.append(i)
+        self.source_lines.append(index)
+
+    def drop_evicted(self):
+        """Move the front past the last line any store has dropped."""
+        for k, store in enumerate(self.stores):
+            first = self._firsts[k]
+            if first is None:
+                continue
+            dropped = min(store.start - first, len(self._positions[k]))
+            if dropped > 0:
+                self.start = max(self.start, self._positions[k][dropped - 1] + 1)
+        if self.start - self.base > 65536:
+            self._trim()
+
+    def _trim(self):
+        del self.source_ids[: self.start - self.base]
+        del self.source_lines[: self.start - self.base]
+        self.base = self.start
+        for k, positions in enumerate(self._positions):
+            gone = bisect_left(positions, self.start)
+            if gone:
+                del positions[:gone]
+                self._firsts[k] += gone
+
+    def raw(self, index):
+        if index < self.start or index >= self.end:
+            raise IndexError(index)
+        offset = index - self.base
+        i = self.source_ids[offset]
+        try:
+            line = self.stores[self.source_stores[i]].raw(self.source_lines[offset])
+        except IndexError:
+            # dropped since the front last moved
+            line = b""
+        return self.prefixes[i] + line
+
+    def __getitem__(self, index):
+        return self.raw(index).decode(errors="replace")
+
+    def get(self, index, default=""):
+        try:
+            return self[index]
+        except IndexError:
+            return default
+
+    def close(self):
+        # the stores belong to their streams
+        pass
+
+
+class ProjectLogStore(_InterleavedLogStore):
+    """A project's lines in the order compose printed them, a view over its service stores.
+
+    The service stores have every line without its "web-1  | " prefix, so each is only kept once.
+    Lines of no service, like "web-1 exited with code 0", and older ones backfilled for this view
+    go in a store of the view's own.
+    """
+
+    def __init__(self, store: LogStore):
+        super().__init__()
+        self.store = store
+        self._add_source(store, b"")
+
+    def __repr__(self):
+        return f"ProjectLogStore(start={self.start}, end={self.end}, store={self.store})"
+
+    def add_container(self, store, prefix):
+        """A source for a container's lines in store, returns the i to add() them with."""
+        return self._add_source(store, prefix)
+
+    def append(self, line):
+        self.store.append(line)
+        self.add(0, self.store.end - 1)
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+    def prepend(self, lines):
+        # what the front moved past goes first, or it would show again behind the new lines
+        self._trim()
+        taken = self.store.prepend(lines)
+        if taken:
+            self.source_ids[:0] = array("H", [0]) * taken
+            self.source_lines[:0] = array("q", range(self.store.start, self.store.start + taken))
+            self._positions[0][:0] = array("q", range(self.base - taken, self.base))
+            self._firsts[0] = self.store.start
+            self.base -= taken
+            self.start = self.base
+        return taken
+
+    def close(self):
+        self.store.close()
+
+
+class ProjectLogStream(LogStream):
+    """`docker compose logs` for a whole project from one process, demultiplexed by service.
+
+    `service(name)` has a stream for just that service's lines without the prefix, the stream's
+    own store shows them all as compose prints them. All of them share the one process, which runs
+    while any of them has a view.
+
+    The command would normally be started with `--tail`, backfill_command(until, services) then
+    gives the one that fetches the lines before until for scrolling further back.
+    """
+
+    def __init__(
+        self,
+        command,
+        project_name,
+        new_store=LogStore,
+        exit_message=False,
+        backfill_command=None,
+    ):
+        super().__init__(command, store=ProjectLogStore(new_store()), exit_message=exit_message)
+        self.project_name = project_name
+        self.new_store = new_store
+        self.backfill_command = backfill_command
+        self.services = {}
+        # container name from the prefix -> service stream and its source in the combined store,
+        # most lines only cost a dict lookup
+        self._containers = {}
+        self.oldest = {}
+        # stream being backfilled -> its task, and the streams that have nothing older left
+        self._backfills = {}
+        self._backfilled = set()
+
+    def __repr__(self):
+        return (
+            f"ProjectLogStream(project={self.project_name}, views={len(self.views)}, "
+            f"services={len(self.services)}, store={self.store})"
+        )
+
+    def service(self, name):
+        if name not in self.services:
+            self.services[name] = ServiceLogStream(self, name, self.new_store())
+        return self.services[name]
+
+    def in_use(self):
+        return bool(self.views) or any(s.views for s in self.services.values())
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        for task in self._backfills.values():
+            task.cancel()
+        for service in self.services.values():
+            service.store.close()
+
+    def _service_for(self, container, prefix):
+        found = self._containers.get(container)
+        if found is None:
+            # web-1, or project-web-1 from older compose versions
+            name = REPLICA_RE.sub("", container.decode(errors="replace"))
+            for project_prefix in [f"{self.project_name}-", f"{self.project_name}_"]:
+                name = name.removeprefix(project_prefix)
+            stream = self.service(name)
+            found = self._containers[container] = (
+                stream,
+                self.store.add_container(stream.store, bytes(prefix)),
+            )
+        return found
+
+    async def _read(self, line_batches):
+        async for lines in line_batches:
+            touched = set()
+            for line in lines:
+                match = LOG_PREFIX_RE.match(line)
+                # "web-1 exited with code 0" and the like only go in the combined store
+                if match is None:
+                    self.store.append(line)
+                    continue
+                container, text = match.groups()
+                stream, source = self._service_for(container, line[: match.start(2)])
+                stream.store.append(text)
+                self.store.add(source, stream.store.end - 1)
+                stream.levels.add(text, timestamp_second(text))
+                touched.add(stream)
+                if container not in stream.oldest:
+                    self._first_line(container, text, stream)
+            self.store.drop_evicted()
+            self._notify()
+            for stream in touched:
+                stream._notify()
+
+    def _first_line(self, container, text, stream):
+        # where backfilling a container starts from, in the combined store and the service's
+        timestamp = parse_timestamp(text)
+        if timestamp is not None:
+            self.oldest.setdefault(container, timestamp)
+            stream.oldest[container] = timestamp
+
+    def backfill(self):
+        self._backfill(self)
+
+    def _backfill(self, target):
+        if (
+            self.backfill_command is None
+            or self.closed
+            or not target.oldest
+            or target in self._backfills
+            or target in self._backfilled
+        ):
+            return
+        self._backfills[target] = asyncio.ensure_future(self._run_backfill(target))
+
+    async def _run_backfill(self, target):
+        services = None if target is self else [target.service]
+        # --until is inclusive, anything a container already has is left out below
+        until = format_timestamp(max(target.oldest.values()))
+        process = None
+        try:
+            process = await stream_process(self.backfill_command(until, services))
+            lines = []
+            async for batch in process.stdout_lines():
+                lines.extend(batch)
+            await process.wait()
+        except OSError as e:
+            print("backfill failed", self, e)
+            lines = []
+        finally:
+            del self._backfills[target]
+            if process is not None and process.returncode is None:
+                process.kill_group()
+
+        older = []
+        timestamps = []
+        keep = False
+        for line in lines:
+            match = LOG_PREFIX_RE.match(line)
+            if match is None:
+                # a line of the one before it, only the combined store has them
+                if keep and target is self:
+                    older.append(line)
+                    timestamps.append(None)
+                continue
+            container, text = match.groups()
+            timestamp = parse_timestamp(text)
+            cutoff = target.oldest.get(container)
+            keep = timestamp is not None and (cutoff is None or timestamp < cutoff)
+            if keep:
+                older.append(line if target is self else text)
+                timestamps.append((container, timestamp))
+
+        taken = target.store.prepend(older)
+        if taken < len(older) or not older:
+            # out of history, or out of room for it
+            self._backfilled.add(target)
+        for item in timestamps[len(timestamps) - taken :] if taken else []:
+            if item is not None:
+                container, timestamp = item
+                target.oldest[container] = min(target.oldest.get(container, timestamp), timestamp)
+        if taken:
+            target._notify()
+
+
+# how long a line can wait in a merged view for a quiet service to catch up before it's shown anyway
+MERGE_GRACE = 2.0
+
+
+@lru_cache(maxsize=4096)
+def _epoch_seconds(stamp):
+    return int(datetime.fromisoformat(stamp.decode() + "+00:00").timestamp())
+
+
+def timestamp_second(line):
+    """The whole second of a line starting with docker's `--timestamps`, or None."""
+    if line[10:11] != b"T" or line[19:20] not in (b".", b"Z"):
+        return None
+    try:
+        return _epoch_seconds(line[:19])
+    except ValueError:
+        return None
+
+
+def format_timestamp(timestamp):
+    """The nanoseconds from parse_timestamp as docker takes them, e.g. for `--until`."""
+    seconds, nanoseconds = divmod(timestamp, 1_000_000_000)
+    stamp = datetime.fromtimestamp(seconds, UTC).strftime("%Y-%m-%dT%H:%M:%S")
+    return f"{stamp}.{nanoseconds:09d}Z"
+
+
+def parse_timestamp(line):
+    """Nanoseconds since the epoch from a line starting with docker's `--timestamps`, or None."""
+    end = line.find(b" ")
+    stamp = line[:end] if end != -1 else line
+    if len(stamp) < 20 or stamp[10:11] != b"T" or not stamp.endswith(b"Z"):
+        return None
+    # lines come in bursts, the whole seconds part is usually cached
+    seconds, _, fraction = stamp[:-1].partition(b".")
+    try:
+        return _epoch_seconds(seconds) * 1_000_000_000 + int(fraction.ljust(9, b"0")[:9])
+    except ValueError:
+        return None
+
+
+class MergedLogStore(_InterleavedLogStore):
+    """Several services' log stores interleaved by timestamp, read like a LogStore.
+
+    Each store is in order already, so this is a k-way merge: the heap only has the next line of
+    every source, and one is let out once every source that isn't quiet has got past its
+    timestamp, or once it has waited `grace` seconds.
+    """
+
+    def __init__(self, sources, labels, grace=MERGE_GRACE):
+        super().__init__()
+        self.sources = sources
+        self.labels = [label.encode() for label in labels]
+        label_width = max((len(label) for label in self.labels), default=0)
+        for source, label in zip(sources, self.labels):
+            self._add_source(source.store, label.ljust(label_width) + b" | ")
+        self.grace = grace
+        self.pending = []
+        # whether merge() stopped with lines it could have let out, for the next step
+        self.done = True
+        # per source, the next line to read and whether the one before it is in the heap
+        self._next = [source.store.start for source in sources]
+        self._queued = [False] * len(sources)
+        self._last_timestamps = [None] * len(sources)
+        # when each source last had something, one that's quiet for longer than grace no longer
+        # holds the others back
+        self._ends = [source.store.start for source in sources]
+        self._heard = [time.monotonic()] * len(sources)
+        self._seq = 0
+
+    def __repr__(self):
+        return f"MergedLogStore(start={self.start}, end={self.end}, pending={len(self.pending)})"
+
+    def merge(self, now, deadline=None):
+        """Let out the sources' lines that can go, until deadline, returns how many were added."""
+        for i, source in enumerate(self.sources):
+            if source.store.end > self._ends[i]:
+                self._ends[i] = source.store.end
+                self._heard[i] = now
+            if not self._queued[i]:
+                self._push(i, now)
+
+        # nothing a source sends later should be older than what it sent last, and one that hasn't
+        # sent anything yet could still send anything, ones with a line in the heap are in order
+        watermark = float("inf")
+        for i in range(len(self.sources)):
+            if not self._queued[i]:
+                watermark = self._lower(watermark, i, now)
+        added = 0
+        self.done = True
+        while self.pending:
+            timestamp, _, i, index, since = self.pending[0]
+            if timestamp > watermark and now - since < self.grace:
+                break
+            heapq.heappop(self.pending)
+            self._queued[i] = False
+            self.add(i, index)
+            added += 1
+            if not self._push(i, now):
+                watermark = self._lower(watermark, i, now)
+            if deadline is not None and added % 256 == 0 and time.monotonic() >= deadline:
+                self.done = False
+                break
+
+        self.drop_evicted()
+        return added
+
+    def _lower(self, watermark, i, now):
+        if now - self._heard[i] >= self.grace:
+            return watermark
+        last = self._last_timestamps[i]
+        return -1 if last is None else min(watermark, last)
+
+    def _push(self, i, now):
+        store = self.sources[i].store
+        index = max(self._next[i], store.start)
+        if index >= store.end:
+            return False
+        timestamp = parse_timestamp(store.raw(index))
+        if timestamp is None:
+            # a continuation line, e.g. a traceback, stays with the line before it
+            timestamp = self._last_timestamps[i] or 0
+        else:
+            self._last_timestamps[i] = timestamp
+        heapq.heappush(self.pending, (timestamp, self._seq, i, index, now))
+        self._seq += 1
+        self._next[i] = index + 1
+        self._queued[i] = True
+        return True
+
+
+# how long one step of merging can keep the event loop, whole histories are merged a step at a time
+MERGE_STEP_SECONDS = 0.005
+
+
+class MergedLogStream:
+    """A time ordered view over several log streams, e.g. the services of a ProjectLogStream."""
+
+    def __init__(self, sources, labels, grace=MERGE_GRACE):
+        self.sources = sources
+        self.store = MergedLogStore(sources, labels, grace=grace)
+        self.views = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._timer = None
+
+    def __repr__(self):
+        return f"MergedLogStream(sources={self.sources}, store={self.store})"
+
+    def subscribe(self, view):
+        self.views.append(view)
+        for source in self.sources:
+            if self not in source.views:
+                source.subscribe(self)
+        view.schedule_update()
+
+    def unsubscribe(self, view):
+        if view in self.views:
+            self.views.remove(view)
+        if not self.views:
+            if self._task is not None:
+                self._task.cancel()
+                self._task = None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            for source in self.sources:
+                source.unsubscribe(self)
+
+    def backfill(self):
+        # lines are only ever merged in at the end
+        pass
+
+    def schedule_update(self):
+        # a source got lines, they're merged in the background
+        self._wakeup.set()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while True:
+                now = time.monotonic()
+                if self.store.merge(now, now + MERGE_STEP_SECONDS):
+                    for view in self.views:
+                        view.schedule_update()
+                if self.store.done:
+                    break
+                await asyncio.sleep(0)
+            if self.store.pending and self._timer is None:
+                # lines held back for a quiet source go out when their grace runs out
+                loop = asyncio.get_running_loop()
+                self._timer = loop.call_later(self.store.grace, self._grace_over)
+
+    def _grace_over(self):
+        self._timer = None
+        self._wakeup.set()
+
+
+class LogStreams:
+    """The shared log streams of the app, keyed by e.g. (compose file, services)."""
+
+    def __init__(self):
+        self.streams = {}
+
+    def __repr__(self):
+        return f"LogStreams({list(self.streams.values())})"
+
+    def get(self, key, create):
+        """The stream for key, made with create() if nothing is showing it at the moment."""
+        stream = self.streams.get(key)
+        if stream is None or stream.closed:
+            stream = create()
+            stream.on_close = lambda s, key=key: self._closed(key, s)
+            self.streams[key] = stream
+        return stream
+
+    def _closed(self, key, stream):
+        if self.streams.get(key) is stream:
+            del self.streams[key]
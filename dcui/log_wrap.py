@@ -0,0 +1,123 @@
+import time
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+from rich.cells import cell_len
+from rich.text import Text
+
+# how long one step of building a wrap index may hold the event loop
+WRAP_STEP_SECONDS = 0.005
+
+
+def line_cells(raw):
+    """How many cells a stored line takes up once drawn."""
+    line = raw.decode(errors="replace")
+    if "\x1b" in line:
+        return Text.from_ansi(line, end="").cell_len
+    return cell_len(line)
+
+
+class WrapIndex:
+    """How many rows each line of a store takes when wrapped at width, as running totals.
+
+    ends[k] is the row just after line base + k, counted from the first line the index ever had,
+    so rows only ever get added at the end and finding the line on a row is a bisect. Lines the
+    store drops are trimmed from the front once in a while without touching the rest. Lines
+    prepended to the store make the index `stale`, it has to be built again.
+    """
+
+    def __init__(self, store, width):
+        self.store = store
+        self.width = max(1, width)
+        self.base = store.start
+        self.ends = array("q")
+        # rows before base, from lines that were trimmed
+        self.origin = 0
+
+    def __repr__(self):
+        rows = self.bottom - self.top
+        return f"WrapIndex(width={self.width}, lines={len(self.ends)}, rows={rows})"
+
+    @property
+    def built(self):
+        return self.base + len(self.ends)
+
+    @property
+    def stale(self):
+        return self.store.start < self.base
+
+    def rows_before(self, line):
+        k = line - self.base
+        if k <= 0:
+            return self.origin
+        return self.ends[min(k, len(self.ends)) - 1]
+
+    @property
+    def top(self):
+        """The row of the first line the store still has."""
+        return self.rows_before(self.store.start)
+
+    @property
+    def bottom(self):
+        return self.ends[-1] if self.ends else self.origin
+
+    def row_of(self, line):
+        return self.rows_before(line)
+
+    def locate(self, row):
+        """(line, row within it) of a row, or None past the end."""
+        if row < self.top or row >= self.bottom:
+            return None
+        k = bisect_right(self.ends, row)
+        line = self.base + k
+        return line, row - self.rows_before(line)
+
+    def extend(self, deadline=None):
+        """Wrap the lines added to the store since, returns whether it got to the end.
+
+        The last line is always wrapped again, it can still grow, e.g. in a followed file.
+        """
+        if self.ends and self.built == self.store.end:
+            self.ends.pop()
+        start = max(self.built, self.store.start)
+        if start > self.built:
+            # everything before was dropped before it was wrapped
+            self.origin = self.bottom
+            self.base = start
+            self.ends = array("q")
+        self._wrap(start, self.store.end, deadline)
+
+        k = self.store.start - self.base
+        if k > 65536:
+            self.origin = self.ends[k - 1]
+            del self.ends[:k]
+            self.base += k
+        return self.built >= self.store.end
+
+    def _add(self, cells):
+        width = self.width
+        rows = accumulate((max(1, -(-n // width)) for n in cells), initial=self.bottom)
+        next(rows)
+        self.ends.extend(rows)
+
+    def _wrap(self, start, end, deadline):
+        chunks = getattr(self.store, "chunks", None)
+        if chunks is None:
+            raw = self.store.raw
+            step = 4096
+            for first in range(start, end, step):
+                self._add(line_cells(raw(n)) for n in range(first, min(first + step, end)))
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+            return
+
+        for first, data, offsets, i, j in chunks(start, end):
+            part = data[offsets[i] : offsets[j]]
+            if part.isascii() and b"\x1b" not in part:
+                # one cell a byte, the lengths are all there is to it
+                self._add(offsets[n + 1] - offsets[n] for n in range(i, j))
+            else:
+                self._add(line_cells(data[offsets[n] : offsets[n + 1]]) for n in range(i, j))
+            if deadline is not None and time.monotonic() >= deadline:
+                return
@@ -0,0 +1,228 @@
+import asyncio
+import time
+
+from .docker_api import DockerApiError
+from .docker_compose import CliBackend, default_backend
+
+# seconds between reconciliation polls. A controller starts at the minimum when it is registered,
+# selected or poked after an action, and doubles its interval every poll that finds nothing
+# changed, up to a limit that depends on whether it is the selected one.
+MIN_POLL_INTERVAL = 1
+SELECTED_POLL_INTERVAL = 10
+IDLE_POLL_INTERVAL = 120
+
+MAX_EVENTS_BACKOFF = 60
+
+BACKEND_ERRORS = (OSError, TimeoutError, DockerApiError, ValueError)
+
+
+class PollSchedule:
+    def __init__(self):
+        self.interval = MIN_POLL_INTERVAL
+        self.next_poll = 0
+        self.polls = 0
+        self.last_latency = 0.0
+        self.total_latency = 0.0
+
+    def __repr__(self):
+        return (
+            f"PollSchedule(interval={self.interval}, polls={self.polls}, "
+            f"last_latency={self.last_latency:.3f}, avg_latency={self.avg_latency:.3f})"
+        )
+
+    @property
+    def avg_latency(self):
+        return self.total_latency / self.polls if self.polls else 0.0
+
+    def reset(self, now):
+        self.interval = MIN_POLL_INTERVAL
+        self.next_poll = now
+
+    def backoff(self, now, max_interval):
+        self.interval = min(self.interval * 2, max_interval)
+        self.next_poll = now + self.interval
+
+    def record(self, now, latency, changed, max_interval):
+        self.polls += 1
+        self.last_latency = latency
+        self.total_latency += latency
+        if changed:
+            self.interval = MIN_POLL_INTERVAL
+            self.next_poll = now + self.interval
+        else:
+            self.backoff(now, max_interval)
+
+
+class StatusService:
+    """Container status for every compose project in the app, from one ps and one event stream.
+
+    Controllers register themselves by project name and get `update_docker_ps` with their slice of
+    the ps result and `apply_event` for each container event of their project.
+    """
+
+    cli_backend = CliBackend()
+
+    def __init__(self, backend=None):
+        self.backend = backend or default_backend()
+        self.controllers = {}
+        self.schedules = {}
+        self.paused = False
+        self._inflight = None
+        self._reconcile_timer = None
+        self._wake = asyncio.Event()
+
+    def register(self, controller):
+        project = controller.docker_compose.project_name
+        self.controllers.setdefault(project, []).append(controller)
+        self.schedules[controller] = PollSchedule()
+        self._wake.set()
+
+    def unregister(self, controller):
+        project = controller.docker_compose.project_name
+        controllers = self.controllers.get(project, [])
+        if controller in controllers:
+            controllers.remove(controller)
+        if not controllers:
+            self.controllers.pop(project, None)
+        self.schedules.pop(controller, None)
+
+    def poke(self, controller=None):
+        """Poll fast again, for one controller or all of them."""
+        now = time.monotonic()
+        for c, schedule in self.schedules.items():
+            if controller is None or c is controller:
+                schedule.reset(now)
+        self._wake.set()
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self._wake.set()
+
+    def stats(self):
+        return dict(self.schedules)
+
+    async def _ps_all(self):
+        if not isinstance(self.backend, CliBackend):
+            try:
+                return await self.backend.ps_all()
+            except BACKEND_ERRORS as e:
+                print("ps backend failed, falling back to cli", self.backend, e)
+
+        return await self.cli_backend.ps_all()
+
+    async def _events_all(self, since):
+        backend = self.backend
+        if not isinstance(backend, CliBackend):
+            started = False
+            try:
+                async for event in backend.events_all(since=since):
+                    started = True
+                    yield event
+                return
+            except BACKEND_ERRORS as e:
+                # once events have been delivered the caller has to reconnect and reconcile
+                if started:
+                    raise
+                print("events backend failed, falling back to cli", backend, e)
+
+        async for event in self.cli_backend.events_all(since=since):
+            yield event
+
+    def _max_interval(self, controller):
+        return SELECTED_POLL_INTERVAL if controller.selected else IDLE_POLL_INTERVAL
+
+    async def _refresh(self):
+        start = time.monotonic()
+        try:
+            data = await self._ps_all()
+        except BACKEND_ERRORS:
+            now = time.monotonic()
+            for controller, schedule in self.schedules.items():
+                schedule.backoff(now, self._max_interval(controller))
+            raise
+        now = time.monotonic()
+
+        for project, controllers in list(self.controllers.items()):
+            for controller in controllers:
+                changed = controller.update_docker_ps(data.get(project, []))
+                schedule = self.schedules.get(controller)
+                if schedule:
+                    schedule.record(now, now - start, changed, self._max_interval(controller))
+
+    def _start_refresh(self):
+        # a refresh asked for while one is running shares its result instead of starting another
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh())
+            self._inflight.add_done_callback(self._refresh_done)
+        return self._inflight
+
+    def _refresh_done(self, task):
+        self._inflight = None
+        if not task.cancelled() and task.exception():
+            print("docker ps failed", task.exception())
+
+    async def refresh(self):
+        await asyncio.shield(self._start_refresh())
+
+    def refresh_soon(self, delay=1):
+        # coalesces bursts, e.g. the start events of an `up`, into a single ps
+        if self._reconcile_timer is None:
+            self._reconcile_timer = asyncio.get_running_loop().call_later(
+                delay, self._refresh_later
+            )
+
+    def _refresh_later(self):
+        self._reconcile_timer = None
+        self._start_refresh()
+
+    def dispatch_event(self, event):
+        if event.get("type") != "container":
+            return
+
+        for controller in self.controllers.get(event.get("project"), []):
+            if controller.apply_event(event):
+                self.refresh_soon()
+
+    async def watch_events(self):
+        backoff = 1
+        while True:
+            # subscribe from just before the reconciliation, so nothing that happens between the
+            # ps and the subscription is lost
+            since = time.time() - 1
+            try:
+                await self.refresh()
+                async for event in self._events_all(since):
+                    backoff = 1
+                    self.dispatch_event(event)
+            except BACKEND_ERRORS as e:
+                print("docker events stream failed", e)
+
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_EVENTS_BACKOFF)
+
+    async def poll(self):
+        while True:
+            self._wake.clear()
+            timeout = None
+            if not self.paused and self.schedules:
+                next_poll = min(s.next_poll for s in self.schedules.values())
+                timeout = next_poll - time.monotonic()
+
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self.refresh()
+            except BACKEND_ERRORS:
+                # already reported and backed off
+                pass
+
+    async def run(self):
+        await asyncio.gather(self.watch_events(), self.poll())
@@ -0,0 +1,227 @@
+"""Terminal emulation for InteractiveShell, run in a process of its own.
+
+    python dcui/terminal.py <pty fd> <columns> <lines> <max fps> <scrollback lines>
+
+pyte is pure python, so emulating a noisy child on the UI's event loop (or a thread, which fights
+it for the GIL) stalls everything else. This process reads the pty itself, feeds pyte and writes
+frames to stdout, each a length prefixed pickle of
+(lines, columns, changed, history, bracketed_paste, final) where changed maps a line number to its
+runs of (text, style) cells and history has the lines that scrolled off the top since the last
+frame, as a str when they have no styling and runs otherwise. bracketed_paste is whether the
+child has asked for pastes to be wrapped in ESC[200~ ESC[201~. stdin takes commands, one per
+line:
+
+    resize <columns> <lines>
+    close                       read what is left in the pty, send the whole screen and exit
+"""
+
+import asyncio
+import os
+import pickle
+import select
+import struct
+import sys
+import time
+from collections import deque
+
+import pyte
+from pyte.screens import Margins
+
+# output is fed to pyte as soon as it arrives, but a frame is sent at most this often
+DEFAULT_MAX_FPS = 30
+
+FRAME_HEADER = struct.Struct("!I")
+
+# pyte keeps private modes shifted, like it does for DECTCEM and friends
+BRACKETED_PASTE = 2004 << 5
+
+# lines kept once they scroll off the top of a shell pane
+DEFAULT_SCROLLBACK = 10000
+
+# fg, bg, bold, italics, underscore, strikethrough, reverse of an unstyled cell
+DEFAULT_STYLE = ("default", "default", False, False, False, False, False)
+
+# every run with the same style shares one tuple, which keeps frames and scrollback small
+_styles = {DEFAULT_STYLE: DEFAULT_STYLE}
+
+
+def pyte_line_runs(line, columns):
+    """A row of pyte character cells as runs of same styled text."""
+    runs = []
+    text = []
+    style = None
+    # a line only has the cells that were written to, everything after the last one is blank
+    written = min(max(line, default=-1) + 1, columns)
+    for x in range(written):
+        char = line[x]
+        key = char[1:8]
+        if key != style:
+            if text:
+                runs.append(("".join(text), style))
+            text = []
+            style = _styles.setdefault(key, key)
+        # the cell after a wide character is empty
+        text.append(char.data)
+    if written < columns:
+        if style != DEFAULT_STYLE:
+            if text:
+                runs.append(("".join(text), style))
+            text = []
+            style = DEFAULT_STYLE
+        text.append(" " * (columns - written))
+    if text:
+        runs.append(("".join(text), style))
+    return runs
+
+
+def compact_runs(runs):
+    """A line for the scrollback, without the blank cells that pad it to the screen width."""
+    if runs and runs[-1][1] == DEFAULT_STYLE:
+        text = runs[-1][0].rstrip()
+        runs = runs[:-1] + [(text, DEFAULT_STYLE)] if text else runs[:-1]
+    if all(style == DEFAULT_STYLE for _, style in runs):
+        return "".join(text for text, _ in runs)
+    return tuple(runs)
+
+
+class ScrollbackScreen(pyte.Screen):
+    """A pyte screen that keeps the lines scrolled off the top until they are sent."""
+
+    def __init__(self, columns, lines, scrollback=DEFAULT_SCROLLBACK):
+        super().__init__(columns, lines)
+        self.scrolled_off = deque(maxlen=scrollback)
+
+    def index(self):
+        top, bottom = self.margins or Margins(0, self.lines - 1)
+        # only the whole screen scrolling counts, not a scroll region inside a full screen app
+        if self.cursor.y == bottom and top == 0 and bottom == self.lines - 1:
+            self.scrolled_off.append(compact_runs(pyte_line_runs(self.buffer[top], self.columns)))
+        super().index()
+
+    def resize(self, lines=None, columns=None):
+        # pyte makes room for a shorter screen by deleting lines from the top
+        for y in range(max(0, self.lines - (lines or self.lines))):
+            self.scrolled_off.append(compact_runs(pyte_line_runs(self.buffer[y], self.columns)))
+        super().resize(lines, columns)
+
+
+def write_frame(out, frame):
+    data = pickle.dumps(frame, pickle.HIGHEST_PROTOCOL)
+    out.write(FRAME_HEADER.pack(len(data)) + data)
+    out.flush()
+
+
+async def read_frame(reader):
+    """The next frame from an asyncio StreamReader, None at the end."""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        (size,) = FRAME_HEADER.unpack(header)
+        return pickle.loads(await reader.readexactly(size))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+class TerminalEmulator:
+    def __init__(
+        self, fd, columns, lines, out, max_fps=DEFAULT_MAX_FPS, scrollback=DEFAULT_SCROLLBACK
+    ):
+        self.fd = fd
+        # pyte takes columns first, and can't grow out of a 0x0 screen
+        self.screen = ScrollbackScreen(max(columns, 1), max(lines, 1), scrollback)
+        self.stream = pyte.ByteStream(self.screen)
+        self.out = out
+        self.frame_time = 1 / max_fps
+        self.last_frame = 0.0
+        self.reading = True
+        self.commands = b""
+        self.bracketed_paste = False
+
+    def send(self, full=False, final=False):
+        screen = self.screen
+        lines = range(screen.lines) if full else screen.dirty
+        changed = {
+            y: pyte_line_runs(screen.buffer[y], screen.columns) for y in lines if y < screen.lines
+        }
+        history = list(screen.scrolled_off)
+        screen.dirty.clear()
+        screen.scrolled_off.clear()
+        self.bracketed_paste = BRACKETED_PASTE in screen.mode
+        frame = (screen.lines, screen.columns, changed, history, self.bracketed_paste, final)
+        write_frame(self.out, frame)
+        self.last_frame = time.monotonic()
+
+    def read_pty(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return False
+        except OSError:
+            # EIO, nothing has the other end of the pty open anymore
+            data = b""
+        if not data:
+            self.reading = False
+            return False
+        self.stream.feed(data)
+        return True
+
+    def command(self, line):
+        """Returns False once it's time to stop."""
+        words = line.split()
+        if words[:1] == [b"resize"]:
+            columns, lines = int(words[1]), int(words[2])
+            if columns and lines and (columns, lines) != (self.screen.columns, self.screen.lines):
+                # marks every line dirty
+                self.screen.resize(lines, columns)
+        elif words[:1] == [b"close"]:
+            return False
+        return True
+
+    def read_commands(self):
+        data = os.read(sys.stdin.fileno(), 4096)
+        if not data:
+            # the UI is gone
+            return False
+        self.commands += data
+        *lines, self.commands = self.commands.split(b"\n")
+        return all(self.command(line) for line in lines)
+
+    def finish(self):
+        os.set_blocking(self.fd, False)
+        while self.reading and self.read_pty():
+            pass
+        self.send(full=True, final=True)
+
+    def run(self):
+        stdin = sys.stdin.fileno()
+        while True:
+            timeout = None
+            if self.screen.dirty:
+                timeout = max(0, self.last_frame + self.frame_time - time.monotonic())
+
+            readable, _, _ = select.select(
+                [stdin, self.fd] if self.reading else [stdin], [], [], timeout
+            )
+            if stdin in readable and not self.read_commands():
+                return self.finish()
+            if self.fd in readable:
+                self.read_pty()
+
+            if self.screen.dirty and time.monotonic() - self.last_frame >= self.frame_time:
+                # the first output in a while, e.g. a keystroke echo, goes out straight away, a
+                # flood is folded into one frame per frame_time
+                self.send()
+            elif self.bracketed_paste != (BRACKETED_PASTE in self.screen.mode):
+                # a mode change doesn't have to draw anything
+                self.send()
+
+
+def main():
+    # when there are fewer cores than busy processes, the UI wins
+    os.nice(5)
+    fd, columns, lines, max_fps, scrollback = map(int, sys.argv[1:6])
+    emulator = TerminalEmulator(fd, columns, lines, sys.stdout.buffer, max_fps, scrollback)
+    emulator.run()
+
+
+if __name__ == "__main__":
+    main()
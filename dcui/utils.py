@@ -1,5 +1,6 @@
 import asyncio
 import os
+import signal
 import socket
 import subprocess
 import threading
@@ -67,7 +68,7 @@ class DockerException(Exception):
 
 
 def stream_stdout_and_stderr(
-    full_cmd: list, env: Dict[str, str] = None, callback=None
+    full_cmd: list, env: Dict[str, str] | None = None, callback=None
 ) -> subprocess.Popen[bytes]:
     if env is None:
         subprocess_env = None
@@ -98,6 +99,87 @@ def stream_stdout_and_stderr(
     return process
 
 
+async def iter_line_batches(stream, read_size=65536):
+    """Yield the complete lines, without line endings, of every read from an asyncio stream.
+
+    Reads are large so a chatty process costs one loop iteration per read rather than per line, a
+    trailing line without a newline is yielded when the stream ends.
+    """
+    partial = b""
+    while chunk := await stream.read(read_size):
+        *lines, partial = (partial + chunk).split(b"\n")
+        if lines:
+            yield [line.rstrip(b"\r") for line in lines]
+    if partial:
+        yield [partial.rstrip(b"\r")]
+
+
+class _ExitProtocol(asyncio.subprocess.SubprocessStreamProtocol):
+    # Process.wait() also waits for the pipes to close, which never happens while something the
+    # process started still holds them, process_exited is called as soon as the child is reaped
+    def __init__(self, limit, loop):
+        super().__init__(limit=limit, loop=loop)
+        self.exited = loop.create_future()
+
+    def process_exited(self):
+        super().process_exited()
+        if not self.exited.done():
+            self.exited.set_result(None)
+
+
+class StreamedProcess:
+    def __init__(self, process: asyncio.subprocess.Process, protocol: _ExitProtocol):
+        self.process = process
+        self.protocol = protocol
+
+    def __repr__(self):
+        return f"StreamedProcess(pid={self.pid}, returncode={self.returncode})"
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    def stdout_lines(self):
+        return iter_line_batches(self.process.stdout)
+
+    def stderr_lines(self):
+        return iter_line_batches(self.process.stderr)
+
+    async def wait(self):
+        # resolved by the event loop's child watcher, nothing polls for it
+        await asyncio.shield(self.protocol.exited)
+        return self.process.returncode
+
+    def kill_group(self, sig=signal.SIGTERM):
+        # the process leads its own session and process group, so this takes down anything it
+        # started too, even after the process itself is gone
+        os.killpg(self.process.pid, sig)
+
+
+async def stream_process(full_cmd: list, env: Dict[str, str] | None = None) -> StreamedProcess:
+    if env is None:
+        subprocess_env = None
+    else:
+        subprocess_env = dict(os.environ)
+        subprocess_env.update(env)
+
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.subprocess_exec(
+        lambda: _ExitProtocol(limit=2**16, loop=loop),
+        *map(str, full_cmd),
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=subprocess_env,
+        start_new_session=True,
+    )
+    return StreamedProcess(asyncio.subprocess.Process(transport, protocol, loop), protocol)
+
+
 async def run_async(command):
     # print("running", command)
     # Create subprocess
@@ -111,3 +193,18 @@ async def run_async(command):
     stdout, stderr = await process.communicate()
     # Return stdout
     return stdout.decode().strip()
+
+
+async def iter_async_lines(command):
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        while line := await process.stdout.readline():
+            yield line.decode()
+    finally:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()